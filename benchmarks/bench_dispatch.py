@@ -0,0 +1,73 @@
+"""
+per-request dispatch-overhead of the ASGI-2 double-callable vs. the native ASGI-3 application of `build_server`
+(the handler does nothing, receive / send are no-ops).
+
+    python -m benchmarks.bench_dispatch [requests]
+"""
+
+import asyncio
+import sys
+import time
+
+from shallot import build_server
+
+
+async def minimal(request):
+    return {"status": 200}
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+def make_scope():
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost"), (b"accept", b"*/*")],
+    }
+
+
+async def measure_asgi2(app, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(make_scope())(receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+async def measure_asgi3(app, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(make_scope(), receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+def main(requests=100_000, rounds=5):
+    """
+    alternates the forms for some rounds and reports the best round of each (the loop is noisy)
+    """
+    loop = asyncio.new_event_loop()
+    apps = [
+        ("asgi2", build_server(minimal), measure_asgi2),
+        ("asgi3", build_server(minimal, asgi3=True), measure_asgi3),
+    ]
+    best = {}
+    try:
+        for _ in range(rounds):
+            for name, app, measure in apps:
+                per_request = loop.run_until_complete(measure(app, requests))
+                best[name] = min(per_request, best.get(name, per_request))
+    finally:
+        loop.close()
+    for name, per_request in best.items():
+        print(f"{name}: {per_request * 1e6:8.2f} µs / request")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,112 @@
+"""
+per-request overhead of a 7-middleware stack:
+    - "shallot-stack": routing, static, json, cookies, parameters, content-type, cors
+    - "pass-through": 7 middlewares that only call the next one (isolates the chaining-overhead)
+
+"before" is the former `apply_middleware` (async terminal handler, composition via closure),
+"after" is `shallot.middlewares.apply_middleware`.
+
+    python -m benchmarks.bench_middleware [requests]
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from functools import partial, reduce
+
+from shallot.middlewares import apply_middleware
+from shallot.middlewares import wrap_routes, wrap_static, wrap_json, wrap_cookies, wrap_parameters, wrap_content_type
+from shallot.middlewares.cors import wrap_cors
+
+
+def legacy_apply_middleware(*middlewares):
+    def _compose(*functions):
+        def compose_two_funcs(func1, func2):
+            def _composition(*args, **kwargs):
+                return func2(func1(*args, **kwargs))
+
+            return _composition
+
+        def composition(*args, **kwargs):
+            composed = reduce(compose_two_funcs, reversed(functions))
+            return composed(*args, **kwargs)
+
+        return composition
+
+    async def exectue_handler(_handler, request):
+        return await _handler(request)
+
+    def _wrap_handler(handler):
+        chained_dispatcher = _compose(*middlewares)(exectue_handler)
+        return partial(chained_dispatcher, handler)
+
+    return _wrap_handler
+
+
+async def user(request, uid):
+    return {"status": 200, "body": uid.encode(), "headers": {}}
+
+
+async def not_found(request):
+    return {"status": 404}
+
+
+def make_middlewares(static_folder):
+    return (
+        wrap_cors(),
+        wrap_content_type(),
+        wrap_static(static_folder),
+        wrap_routes([("/api/users/{uid}", ["GET"], user)]),
+        wrap_cookies(),
+        wrap_parameters(),
+        wrap_json(),
+    )
+
+
+def wrap_pass_through(next_middleware):
+    async def pass_through(handler, request):
+        return await next_middleware(handler, request)
+
+    return pass_through
+
+
+def make_request():
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/users/3",
+        "query_string": b"a=1",
+        "headers": {"cookie": "session=1", "content-type": "text/plain"},
+        "body": b"",
+    }
+
+
+async def measure(handler, requests):
+    for _ in range(1000):
+        await handler(make_request())
+    start = time.perf_counter()
+    for _ in range(requests):
+        await handler(make_request())
+    return (time.perf_counter() - start) / requests
+
+
+def main(requests=100_000):
+    with tempfile.TemporaryDirectory() as static_folder:
+        stacks = {"shallot-stack": make_middlewares(static_folder), "pass-through": (wrap_pass_through,) * 7}
+        loop = asyncio.new_event_loop()
+        try:
+            for stack_name, middlewares in stacks.items():
+                handlers = {
+                    "before": legacy_apply_middleware(*middlewares)(not_found),
+                    "after": apply_middleware(*middlewares)(not_found),
+                }
+                for name, handler in handlers.items():
+                    per_request = loop.run_until_complete(measure(handler, requests))
+                    print(f"{stack_name:>14} {name:>7}: {per_request * 1e6:8.2f} µs / request")
+        finally:
+            loop.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,70 @@
+"""
+dispatch-time of dynamic routes for routing-tables with 10, 100 and 1000 dynamic routes (all in the same
+slash-count bucket, the requested route is the last one = worst case for a linear scan).
+
+"before" is the former dynamic router (`re.fullmatch` per pattern-string), "after" is
+`shallot.middlewares.routing.router` (one compiled alternation per bucket), "radix" is
+`shallot.middlewares.routing.radix_router`, "cached" is `router` with a LRU-cache (`cache_size`) for the resolved
+dynamic routes (the requested path is always a hit there).
+
+    python -m benchmarks.bench_routing [lookups]
+"""
+
+import re
+import sys
+import time
+from collections import defaultdict
+from functools import partial
+
+from shallot.middlewares.routing import router, radix_router
+
+
+def legacy_router(routing_table):
+    dyn_router = defaultdict(dict)
+    for route, methods, dispatch in routing_table:
+        regex_path = re.sub(r"\{(.+)\}", "(.*)", route)
+        old_methods = dyn_router.get(route.count("/"), {}).get(regex_path, {})
+        dyn_router[route.count("/")].update({regex_path: {**old_methods, **{meth: dispatch for meth in methods}}})
+
+    def dispatch(request):
+        path = request["path"].rstrip("/")
+        method = request["method"]
+        for possible, extra_info in dyn_router.get(path.count("/"), {}).items():
+            match = re.fullmatch(possible, path)
+            if match and method in extra_info:
+                return extra_info[method], match.groups()
+        return None, None
+
+    return dispatch
+
+
+async def handler(request, rid):
+    return {"status": 200}
+
+
+def measure(dispatch, request, lookups):
+    start = time.perf_counter()
+    for _ in range(lookups):
+        dispatch(request)
+    return (time.perf_counter() - start) / lookups
+
+
+def main(lookups=10_000):
+    for num_routes in [10, 100, 1000]:
+        table = [(f"/resource{i}/{{rid}}", ["GET"], handler) for i in range(num_routes)]
+        request = {"path": f"/resource{num_routes - 1}/abc", "method": "GET"}
+        for name, make_router in [
+            ("before", legacy_router),
+            ("after", router),
+            ("radix", radix_router),
+            ("cached", partial(router, cache_size=1024)),
+        ]:
+            dispatch = make_router(table)
+            assert dispatch(request)[1] == ("abc",)
+            # the former router re-compiles its patterns, once there are more than `re` caches -> fewer lookups
+            per_lookup = min(measure(dispatch, request, max(lookups * 10 // num_routes, 10)) for _ in range(3))
+            print(f"{num_routes:>5} routes {name:>7}: {per_lookup * 1e6:9.2f} µs / lookup")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,6 +1,8 @@
 # flake8: noqa F401
-from .ring import build_server
+from .ring import build_server, read_body, BodyTooLarge, ClientDisconnected
 from .websocket import websocket, WSDisconnect
+from .admission import AdmissionController
+from .processpool import cpu_bound
 from . import response as _response
 
 
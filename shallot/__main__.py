@@ -0,0 +1,22 @@
+import argparse
+import os
+from shallot.middlewares.staticfiles import precompress_static
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m shallot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    precompress = commands.add_parser("precompress", help="write gzip-sidecars (<file>.gz) for a static-folder")
+    precompress.add_argument("folder")
+    precompress.add_argument("--min-size", type=int, default=256, help="skip files smaller than this (bytes)")
+    args = parser.parse_args(argv)
+
+    if args.command == "precompress":
+        if not os.path.isdir(args.folder):
+            parser.error(f"the provided path <{args.folder}> is not a directory!")
+        written = precompress_static(args.folder, min_size=args.min_size)
+        print(f"wrote {len(written)} gzip-sidecars")
+
+
+if __name__ == "__main__":
+    main()
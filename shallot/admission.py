@@ -0,0 +1,114 @@
+from asyncio import get_event_loop, wait_for, CancelledError, TimeoutError as AsyncTimeoutError
+from collections import deque
+
+
+class AdmissionController:
+    """
+    bounds the number of concurrently handled http-requests. Requests exceeding `max_in_flight` wait in a
+    queue of at most `max_queue` entries (for at most `max_queue_wait_s` seconds). Everything else gets shed.
+    When `max_loop_lag_s` is provided, requests are shed too, while the event-loop lags more than that.
+    Shed requests are answered with `503` and a `retry-after` of `retry_after_s` seconds.
+    """
+
+    def __init__(
+        self,
+        max_in_flight,
+        max_queue=0,
+        max_queue_wait_s=None,
+        max_loop_lag_s=None,
+        retry_after_s=1,
+        lag_probe_interval_s=0.1,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_wait_s = max_queue_wait_s
+        self.max_loop_lag_s = max_loop_lag_s
+        self.retry_after_s = retry_after_s
+        self.lag_probe_interval_s = lag_probe_interval_s
+        self.in_flight = 0
+        self.loop_lag_s = 0.0
+        self.shed = 0
+        self._waiters = deque()
+        self._probe = None
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _probe_loop_lag(self, loop, expected_at):
+        self.loop_lag_s = max(loop.time() - expected_at, 0.0)
+        next_at = loop.time() + self.lag_probe_interval_s
+        self._probe = loop.call_at(next_at, self._probe_loop_lag, loop, next_at)
+
+    def _ensure_lag_probe(self):
+        if self._probe is None and self.max_loop_lag_s is not None:
+            loop = get_event_loop()
+            next_at = loop.time() + self.lag_probe_interval_s
+            self._probe = loop.call_at(next_at, self._probe_loop_lag, loop, next_at)
+
+    def close(self):
+        if self._probe is not None:
+            self._probe.cancel()
+            self._probe = None
+
+    async def admit(self):
+        """
+        :return: True when the request got admitted (then `release` must be called once it's done), else False
+        """
+        self._ensure_lag_probe()
+        if self.max_loop_lag_s is not None and self.loop_lag_s > self.max_loop_lag_s:
+            self.shed += 1
+            return False
+
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            return True
+
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+
+        waiter = get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await wait_for(waiter, self.max_queue_wait_s)
+        except AsyncTimeoutError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()  # the slot was handed over together with the timeout -> pass it on
+            else:
+                self._remove_waiter(waiter)
+            self.shed += 1
+            return False
+        except CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # the slot was already handed over -> pass it on
+            else:
+                self._remove_waiter(waiter)
+            raise
+        if not waiter.result():  # shed while waiting (see `shed_queued`)
+            self.shed += 1
+            return False
+        return True  # the slot got handed over by `release`
+
+    def _remove_waiter(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def shed_queued(self):
+        """
+        rejects all queued requests, e.g. when the server starts draining.
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(False)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.in_flight -= 1
@@ -6,13 +6,15 @@ from .json import wrap_json
 from .parameters import wrap_parameters
 from .staticfiles import wrap_static
 from .routing import wrap_routes
+from shallot.threadpool import ensure_async
 
 
 def _compose(*functions):
     """
     compose 2-N functions in a way that a function call of the composed
     function would end up like this:
-        f_3(f_2(f_1(*args, **kwargs))))
+        f_1(f_2(f_3(*args, **kwargs))))
+    The composition is built once, calling the result does not re-compose anything.
     If you compose just 1 function the same function will be returned as a shortcut
     :param functions: functions you want to compose
     :return: composed functions
@@ -24,29 +26,26 @@ def _compose(*functions):
 
         return _composition
 
-    def composition(*args, **kwargs):
-        funcs = reversed(functions)
-        composed = reduce(compose_two_funcs, funcs)
-        return composed(*args, **kwargs)
-
     if len(functions) == 1:
         return functions[0]
 
-    return composition
+    return reduce(compose_two_funcs, reversed(functions))
+
+
+def _execute_handler(handler, request):
+    # not a coroutine-function on purpose: the last middleware awaits the handler-coroutine directly
+    return handler(request)
 
 
 def apply_middleware(*middlewares):
     """
     :param middlewares: middleware-functions to wrap-up
-    :return: wrapper-function to use with handler -> server
+    :return: wrapper-function to use with handler -> server (synchronous handlers run on a thread-pool)
     """
-
-    async def exectue_handler(_handler, request):
-        return await _handler(request)
+    chained_dispatcher = _compose(*middlewares)(_execute_handler) if middlewares else _execute_handler
 
     def _wrap_handler(handler):
-        call_chain = middlewares
-        chained_dispatcher = _compose(*call_chain)(exectue_handler)
-        return partial(chained_dispatcher, handler)
+        handler = ensure_async(handler)
+        return partial(chained_dispatcher, handler) if middlewares else handler
 
     return _wrap_handler
@@ -1,5 +1,6 @@
 import json
 from shallot.response import respond400
+from shallot.ring import read_body
 
 
 def wrap_json(fail_on_missing_body=False):
@@ -7,7 +8,7 @@ def wrap_json(fail_on_missing_body=False):
         async def json_result(handler, request):
             content_type = request.get("headers", {}).get("content-type", "")
             is_right_content_type = "application/json" in content_type
-            has_body = bool(request.get("body"))
+            has_body = bool(await read_body(request)) if is_right_content_type else False
 
             if is_right_content_type and has_body:
                 try:
@@ -1,4 +1,5 @@
 from urllib.parse import parse_qs
+from shallot.ring import read_body
 
 
 def wrap_parameters(keep_blank_values=False, strict_parsing=False, encoding="utf-8"):
@@ -19,7 +20,7 @@ def wrap_parameters(keep_blank_values=False, strict_parsing=False, encoding="utf
             request_content_types = request.get("headers", {}).get("content-type", "")
             if "application/x-www-form-urlencoded" in request_content_types:
                 form_params = parse_qs(
-                    request["body"].decode(encoding),
+                    (await read_body(request)).decode(encoding),
                     keep_blank_values=keep_blank_values,
                     strict_parsing=strict_parsing,
                     encoding=encoding,
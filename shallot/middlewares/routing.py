@@ -1,5 +1,8 @@
 from collections import defaultdict
+from collections import namedtuple, OrderedDict
 import re
+from uuid import UUID
+from shallot.threadpool import ensure_async
 
 
 class RPartial:
@@ -41,22 +44,86 @@ def build_static_router(routing_table):
     return static_router
 
 
+def route_to_regex(route):
+    """
+    :return: regex (as string) for the dynamic `route` with one group per `{tag}`, and the number of tags
+    """
+    static_parts = re.split(r"\{[^}]+\}", route)
+    return "([^/]*)".join(map(re.escape, static_parts)), len(static_parts) - 1
+
+
 def build_dynamic_router(routing_table):
+    """
+    :return: {(number of slashes, method): (regex, targets)}. All dynamic routes of a bucket are compiled into one
+        alternation, every route ends with an empty named group (the marker of the route). `targets` maps the
+        group-names to (handler, first-parameter, last-parameter + 1) as indices into `match.groups()`.
+    """
     dynamic_routes = list(filter(lambda entry: "{" in entry[0], routing_table))
-    dyn_router = defaultdict(dict)
+    buckets = defaultdict(dict)
     for route, methods, dispatch in dynamic_routes:
-        regex_path = re.sub(r"\{(.+)\}", "(.*)", route)
-        num_slashes = route.count("/")
-        old_methods = dyn_router.get(num_slashes, {}).get(regex_path, {})
-        new_methods = {meth: dispatch for meth in methods}
-        dyn_router[num_slashes].update({regex_path: {**old_methods, **new_methods}})
+        regex_path, num_params = route_to_regex(route)
+        for meth in methods:
+            buckets[(route.count("/"), meth)][regex_path] = (num_params, dispatch)
+
+    dyn_router = {}
+    for bucket, routes in buckets.items():
+        alternatives, targets, group = [], {}, 0
+        for idx, (regex_path, (num_params, dispatch)) in enumerate(routes.items()):
+            # a marker at the end instead of a group around the route: a group opened at the start of every
+            # alternative makes `re` save / restore all groups per tried alternative (quadratic in the routes)
+            alternatives.append(f"{regex_path}(?P<r{idx}>)")
+            targets[f"r{idx}"] = (dispatch, group, group + num_params)
+            group += num_params + 1
+        dyn_router[bucket] = (re.compile("|".join(alternatives)), targets)
     return dyn_router
 
 
-def router(routing_table):
-    routing_table = list(remove_trailing_slashes_from_routing_table(routing_table))
-    static_router = build_static_router(routing_table)
-    dynamic_router = build_dynamic_router(routing_table)
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class ResolutionCache:
+    """
+    LRU-cache of `(path, method) -> (handler, args)` wrapping `resolve(path, method)`. Only resolved routes are
+    cached: misses (e.g. scans of random paths) are resolved every time, so they never evict resolved routes.
+    """
+
+    __slots__ = ("resolve", "maxsize", "hits", "misses", "_entries")
+
+    def __init__(self, resolve, maxsize):
+        self.resolve = resolve
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __call__(self, path, method):
+        key = (path, method)
+        found = self._entries.get(key)
+        if found is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return found
+
+        self.misses += 1
+        found = self.resolve(path, method)
+        if found[0] is not None:
+            self._entries[key] = found
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return found
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+
+def make_dispatch(static_router, resolve_dynamic, cache_size=0):
+    """
+    :return: `dispatch(request) -> (handler, args)`, looking up static routes first and resolving all others via
+        `resolve_dynamic(path, method)`. With `cache_size` > 0, the resolved routes are cached in a
+        `ResolutionCache`, its hits / misses are reported by `dispatch.cache_info()`.
+    """
+    if cache_size:
+        resolve_dynamic = ResolutionCache(resolve_dynamic, cache_size)
 
     def dispatch(request):
         path = request["path"].rstrip("/")
@@ -64,21 +131,163 @@ def router(routing_table):
         try:
             return static_router[path][method], tuple()
         except KeyError:
-            regex_matchers = dynamic_router.get(path.count("/"))
-            if not regex_matchers:
-                return None, None
-            for possible, extra_info in regex_matchers.items():
-                match = re.fullmatch(possible, path)
-                if match and method in extra_info:
-                    return extra_info[method], match.groups()
-            else:
-                return None, None
+            return resolve_dynamic(path, method)
 
+    dispatch.cache_info = getattr(resolve_dynamic, "cache_info", None)
     return dispatch
 
 
-def wrap_routes(routing_table):
-    _router = router(routing_table)
+def router(routing_table, cache_size=0):
+    """
+    :param cache_size: when > 0, the resolved dynamic routes (keyed by path and method) are cached in a
+        LRU-cache of this size (misses are not cached). Its statistics are available via `<router>.cache_info()`.
+    """
+    routing_table = list(remove_trailing_slashes_from_routing_table(routing_table))
+    static_router = build_static_router(routing_table)
+    dynamic_router = build_dynamic_router(routing_table)
+
+    def resolve_dynamic(path, method):
+        bucket = dynamic_router.get((path.count("/"), method))
+        if bucket is None:
+            return None, None
+        regex, targets = bucket
+        match = regex.fullmatch(path)
+        if match is None:
+            return None, None
+        handler, first, last = targets[match.lastgroup]
+        return handler, match.groups()[first:last]
+
+    return make_dispatch(static_router, resolve_dynamic, cache_size)
+
+
+def _to_int(segment):
+    if not (segment.isascii() and segment.isdigit()):
+        raise ValueError(f"not an unsigned integer: {segment}")
+    return int(segment)
+
+
+def _to_str(segment):
+    if not segment:
+        raise ValueError("empty path-segment")
+    return segment
+
+
+# converters tried for a path-segment, in this order (after the static segments)
+CONVERTERS = {"int": _to_int, "uuid": UUID, "str": _to_str}
+CATCH_ALL_CONVERTER = "path"
+
+
+class RadixNode:
+    __slots__ = ("static", "params", "handlers", "catch_all")
+
+    def __init__(self):
+        self.static = {}
+        self.params = {}
+        self.handlers = {}
+        self.catch_all = {}
+
+    def lookup(self, segments, idx, method, args):
+        if idx == len(segments):
+            handler = self.handlers.get(method)
+            if handler is not None:
+                return handler, args
+        else:
+            segment = segments[idx]
+            child = self.static.get(segment)
+            if child is not None:
+                found = child.lookup(segments, idx + 1, method, args)
+                if found is not None:
+                    return found
+            for convert, child in self.params.values():
+                try:
+                    value = convert(segment)
+                except ValueError:
+                    continue
+                found = child.lookup(segments, idx + 1, method, args + (value,))
+                if found is not None:
+                    return found
+            handler = self.catch_all.get(method)
+            if handler is not None:
+                return handler, args + ("/".join(segments[idx:]),)
+        return None
+
+
+def _segment_converter(route, segment):
+    """
+    :return: the name of the converter for a `{tag}`-segment, None for static segments
+    """
+    if not (segment.startswith("{") and segment.endswith("}")):
+        if "{" in segment or "}" in segment:
+            raise ValueError(f"tags must span whole path-segments, got <{segment}> in route: {route}")
+        return None
+    converter = segment[1:-1].partition(":")[2] or "str"
+    if converter != CATCH_ALL_CONVERTER and converter not in CONVERTERS:
+        raise ValueError(f"unknown converter <{converter}> in route: {route}")
+    return converter
+
+
+def build_radix_tree(routing_table):
+    """
+    segment-based tree of all dynamic routes. Tags may have a converter (`{id:int}`, `{id:uuid}`, `{name:str}`,
+    default: `str`); `{rest:path}` has to be the last segment and matches the remaining path.
+
+    :raises ValueError: for invalid routes and routes that are ambiguous (same segments and method)
+    """
+    root = RadixNode()
+    for route, methods, dispatch in filter(lambda entry: "{" in entry[0], routing_table):
+        node, targets = root, None
+        segments = route.split("/")[1:]
+        for position, segment in enumerate(segments):
+            converter = _segment_converter(route, segment)
+            if converter is None:
+                node = node.static.setdefault(segment, RadixNode())
+            elif converter == CATCH_ALL_CONVERTER:
+                if position != len(segments) - 1:
+                    raise ValueError(f"<{segment}> has to be the last segment of route: {route}")
+                targets = node.catch_all
+            else:
+                if converter not in node.params:
+                    node.params[converter] = (CONVERTERS[converter], RadixNode())
+                    # the converters are tried in the order of CONVERTERS
+                    node.params = {name: node.params[name] for name in CONVERTERS if name in node.params}
+                node = node.params[converter][1]
+
+        targets = node.handlers if targets is None else targets
+        for meth in methods:
+            if meth in targets:
+                raise ValueError(f"ambiguous route: {route} [{meth}] matches the same paths as a previous route")
+            targets[meth] = dispatch
+    return root
+
+
+def radix_router(routing_table, cache_size=0):
+    """
+    router with the same interface as `router`: static routes are matched via dict, dynamic routes by walking
+    a radix-tree (see `build_radix_tree`) segment by segment, so the lookup scales with the depth of the path
+    instead of the number of routes.
+    """
+    routing_table = list(remove_trailing_slashes_from_routing_table(routing_table))
+    static_router = build_static_router(routing_table)
+    radix_tree = build_radix_tree(routing_table)
+
+    def resolve_dynamic(path, method):
+        found = radix_tree.lookup(path.split("/")[1:], 0, method, tuple())
+        return (None, None) if found is None else found
+
+    return make_dispatch(static_router, resolve_dynamic, cache_size)
+
+
+ROUTERS = {"regex": router, "radix": radix_router}
+
+
+def wrap_routes(routing_table, backend="regex", cache_size=0):
+    """
+    :param backend: `"regex"` (default) or `"radix"` (see `radix_router`, supports typed tags like `{id:int}`)
+    :param cache_size: size of the LRU-cache for resolved dynamic routes (0: no cache). Its hits / misses are
+        reported by `<middleware>.cache_info()`.
+    """
+    table = [(route, methods, ensure_async(handler)) for route, methods, handler in routing_table]
+    _router = ROUTERS[backend](table, cache_size=cache_size)
 
     def wrap_middleware(next_middleware):
         async def dispatch_handler(handler, request):
@@ -90,4 +299,5 @@ def wrap_routes(routing_table):
 
         return dispatch_handler
 
+    wrap_middleware.cache_info = _router.cache_info
     return wrap_middleware
@@ -0,0 +1,219 @@
+import mmap
+import os
+import struct
+import tarfile
+import zipfile
+import zlib
+from calendar import timegm
+from email.utils import formatdate
+from hashlib import md5
+from mimetypes import guess_type
+from shallot.response import respond404
+from shallot.middlewares.staticfiles import respond_file, negotiate_encodings, normalize_mount
+
+# gzip-header: magic, deflate, no flags, no mtime, no extra-flags, unknown os
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+class ArchiveMember:
+    __slots__ = ("offset", "size", "file_size", "crc", "deflated", "headers", "gzip_headers", "inflated")
+
+    def __init__(self, name, offset, size, file_size, crc, deflated, modified):
+        self.offset = offset
+        self.size = size
+        self.file_size = file_size
+        self.crc = crc
+        self.deflated = deflated
+        self.headers = {
+            "last-modified": formatdate(modified, usegmt=True),
+            "content-length": str(file_size),
+            "etag": md5(f"{name}-{crc}-{file_size}-{modified}".encode()).hexdigest(),
+            "accept-ranges": "bytes",
+            "content-type": guess_type(name)[0] or "application/octet-stream",
+        }
+        self.gzip_headers = None
+        self.inflated = None  # decompressed content of small deflated members, once it got requested
+        if deflated:
+            self.headers["vary"] = "accept-encoding"
+            self.gzip_headers = dict(self.headers, **{"content-encoding": "gzip"})
+            self.gzip_headers["content-length"] = str(len(_GZIP_HEADER) + size + 8)
+            self.gzip_headers["etag"] = self.headers["etag"] + "-gzip"
+
+
+def _index_zip(path, mapped):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            if info.flag_bits & 0x1:
+                raise ValueError(f"encrypted archive-members are not supported: {info.filename}")
+            if info.compress_type not in {zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED}:
+                raise ValueError(f"archive-members must be stored or deflated: {info.filename}")
+            # the data starts after the local file-header (30 bytes + name + extra-field of the *local* header)
+            name_length, extra_length = struct.unpack_from("<HH", mapped, info.header_offset + 26)
+            offset = info.header_offset + 30 + name_length + extra_length
+            deflated = info.compress_type == zipfile.ZIP_DEFLATED
+            modified = timegm(info.date_time)
+            yield info.filename, offset, info.compress_size, info.file_size, info.CRC, deflated, modified
+
+
+def _index_tar(path):
+    with tarfile.open(path, "r:") as archive:  # compressed tar-files can't be read at offsets
+        for info in archive.getmembers():
+            if info.isfile():
+                yield info.name, info.offset_data, info.size, info.size, None, False, int(info.mtime)
+
+
+class StaticArchive:
+    """
+    memory-mapped zip- or (uncompressed) tar-archive, indexed once: `members` maps the member-names (without
+    `member_prefix`) to their location in the archive. `reload` re-opens the archive (e.g. after it got
+    replaced by a new deployment). The archive must be replaced atomically (write a new file, then `os.replace`
+    it): the memory-map of an archive rewritten in place changes under running requests (or crashes the
+    process with `SIGBUS`, when the file gets truncated).
+    """
+
+    def __init__(self, path, member_prefix=""):
+        self.path = path
+        self.member_prefix = member_prefix
+        self.members = {}
+        self.view = None
+        self.reload()
+
+    def __len__(self):
+        return len(self.members)
+
+    def reload(self):
+        with open(self.path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        entries = _index_zip(self.path, mapped) if zipfile.is_zipfile(self.path) else _index_tar(self.path)
+        members = {
+            name[len(self.member_prefix) :]: ArchiveMember(name, *location)
+            for name, *location in entries
+            if name.startswith(self.member_prefix)
+        }
+        # the previous map is closed when garbage-collected (responses may still reference it)
+        self.view, self.members = memoryview(mapped), members
+
+    def read(self, member):
+        return self.view[member.offset : member.offset + member.size]
+
+
+def _gzip_parts(archive, member):
+    trailer = struct.pack("<LL", member.crc, member.file_size & 0xFFFFFFFF)
+    return [_GZIP_HEADER, archive.read(member), trailer]
+
+
+def _slice_parts(parts, offset, end, chunk_size):
+    """
+    yields the bytes `offset` to `end` of the concatenated `parts` as slices of at most `chunk_size` bytes
+    """
+    part_at = 0
+    for part in parts:
+        start, stop = max(offset - part_at, 0), min(end - part_at, len(part))
+        for position in range(start, stop, chunk_size):
+            yield part[position : min(position + chunk_size, stop)]
+        part_at += len(part)
+
+
+def _inflate(compressed, chunk_size):
+    """
+    yields the decompressed content of the raw-deflate `compressed` as chunks of at most `chunk_size` bytes
+    """
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    for compressed_at in range(0, len(compressed), chunk_size):
+        pending = compressed[compressed_at : compressed_at + chunk_size]
+        while True:
+            chunk = inflater.decompress(pending, chunk_size)
+            pending = inflater.unconsumed_tail
+            if chunk:
+                yield chunk
+            # a full chunk means, zlib may still hold output - even when the whole input is consumed
+            if not pending and (len(chunk) < chunk_size or inflater.eof):
+                break
+    rest = inflater.flush()
+    if rest:
+        yield rest
+
+
+def wrap_static_archive(archive_path, root_path=".", mount="/", member_prefix="", stream_threshold=256 * 1024):
+    """
+    serves static files directly from a zip- or (uncompressed) tar-archive. The archive is indexed and
+    memory-mapped once, so serving a member needs no file-system access at all. Deflated zip-members are sent
+    as they are (wrapped as gzip) to clients accepting gzip, and decompressed for everybody else.
+
+    :param member_prefix: prefix of the member-names to serve (e.g. `dist/`), it's stripped from the names
+    :param stream_threshold: stored members larger than this are streamed as slices of the memory-map, so are
+        deflated members wrapped as gzip. Deflated members up to this (decompressed) size are decompressed once
+        and kept in memory for clients without gzip, larger ones are decompressed while they are streamed.
+    """
+    archive = StaticArchive(os.path.join(root_path, archive_path), member_prefix)
+    mount = normalize_mount(mount)
+    strip = len(mount)
+
+    def stream_member(member, headers=None, offset=0, length=None):
+        end = member.size if length is None else offset + length
+
+        async def streamer():
+            for chunk in _slice_parts([archive.read(member)], offset, end, stream_threshold):
+                yield chunk
+
+        return {"status": 200, "body": b"", "stream": streamer(), "headers": {} if headers is None else headers}
+
+    def stream_gzip_member(member, headers=None, offset=0, length=None):
+        end = int(member.gzip_headers["content-length"]) if length is None else offset + length
+
+        async def streamer():
+            for chunk in _slice_parts(_gzip_parts(archive, member), offset, end, stream_threshold):
+                yield chunk
+
+        return {"status": 200, "body": b"", "stream": streamer(), "headers": {} if headers is None else headers}
+
+    def inflate_member(member, headers=None, offset=0, length=None):
+        end = member.file_size if length is None else offset + length
+
+        async def streamer():
+            position = 0  # in the decompressed content
+            for chunk in _inflate(archive.read(member), stream_threshold):
+                chunk_at, position = position, position + len(chunk)
+                if position > offset:
+                    yield chunk[max(offset - chunk_at, 0) : end - chunk_at]
+                if position >= end:
+                    break
+
+        return {"status": 200, "body": b"", "stream": streamer(), "headers": {} if headers is None else headers}
+
+    def respond_member(request, member):
+        if not member.deflated:
+            if member.size > stream_threshold:
+                return respond_file(request, member.headers, path=member, streamer=stream_member)
+            return respond_file(request, member.headers, content=bytes(archive.read(member)))
+
+        accept_encoding = request.get("headers", {}).get("accept-encoding", "")
+        if accept_encoding and negotiate_encodings(accept_encoding, ("gzip",)):
+            if member.size > stream_threshold:
+                return respond_file(request, member.gzip_headers, path=member, streamer=stream_gzip_member)
+            return respond_file(request, member.gzip_headers, content=b"".join(_gzip_parts(archive, member)))
+        if member.file_size > stream_threshold:
+            return respond_file(request, member.headers, path=member, streamer=inflate_member)
+        if member.inflated is None:
+            member.inflated = zlib.decompress(archive.read(member), -zlib.MAX_WBITS)
+        return respond_file(request, member.headers, content=member.inflated)
+
+    def wrap_static_archive_files(next_middleware):
+        async def _handle_request(handler, request):
+            path = request["path"]
+            if not path.startswith(mount) or request["method"] not in {"GET", "HEAD"}:
+                return await next_middleware(handler, request)
+            if "../" in path:
+                return respond404()
+
+            member = archive.members.get(path[strip:])
+            if member is None:
+                return await next_middleware(handler, request)
+            return respond_member(request, member)
+
+        return _handle_request
+
+    wrap_static_archive_files.archive = archive
+    return wrap_static_archive_files
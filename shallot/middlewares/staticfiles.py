@@ -1,9 +1,17 @@
 import os
 import re
-from shallot.response import respond404, filestream, respond_not_modified
+import stat
+import time
+from asyncio import ensure_future, get_event_loop
+import zlib
+from collections import OrderedDict
+from mimetypes import guess_type
+import aiofiles
+from shallot.response import respond404, filestream, mmap_filestream, respond_not_modified, text
 from aiofiles.os import stat as astat
 from email.utils import formatdate
-from hashlib import md5
+from hashlib import md5, sha256
+from uuid import uuid4
 
 
 def validate_dir_path(path):
@@ -21,6 +29,7 @@ def make_caching_headers(filestats):
         "last-modified": formatdate(filestats.st_mtime, usegmt=True),
         "content-length": str(filestats.st_size),
         "etag": etag,
+        "accept-ranges": "bytes",
     }
 
 
@@ -30,36 +39,584 @@ def extract_matching_cache(client_headers):
     return {k: v for k, v in [("last-modified", last_modified), ("etag", etag)] if v is not None}
 
 
-def wrap_static(static_folder, root_path="."):
+def parse_range(range_header, size, max_ranges=16):
+    """
+    :return: list of (offset, length) for a `range: bytes=...` - header. `None` when the header is
+        malformed / not understood (-> the whole file is served), `[]` when no range is satisfiable (-> 416)
+    """
+    unit, _, specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        first, sep, last = spec.strip().partition("-")
+        if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:  # suffix-range: the last <last> bytes
+            length = min(int(last), size)
+            if length:
+                ranges.append((size - length, length))
+            continue
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, end - start + 1))
+
+    if len(ranges) > max_ranges:
+        return None
+    return ranges
+
+
+def if_range_matches(client_headers, caching_headers):
+    if_range = client_headers.get("if-range")
+    if if_range is None:
+        return True
+    return if_range.strip() in {caching_headers["etag"], caching_headers["last-modified"]}
+
+
+def respond_range_not_satisfiable(size):
+    response = text("Range Not Satisfiable", status=416)
+    response["headers"]["content-range"] = f"bytes */{size}"
+    return response
+
+
+def _multipart_byteranges(ranges, size, content_type, read_part):
+    boundary = uuid4().hex
+    part_headers = [
+        (
+            f"--{boundary}\r\ncontent-type: {content_type}\r\n"
+            f"content-range: bytes {offset}-{offset + length - 1}/{size}\r\n\r\n"
+        ).encode()
+        for offset, length in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode()
+    content_length = sum(map(len, part_headers)) + sum(length + 2 for _, length in ranges) + len(closing)
+
+    async def streamer():
+        for part_header, (offset, length) in zip(part_headers, ranges):
+            yield part_header
+            async for chunk in read_part(offset, length):
+                yield chunk
+            yield b"\r\n"
+        yield closing
+
+    headers = {"content-type": f"multipart/byteranges; boundary={boundary}", "content-length": str(content_length)}
+    return headers, streamer()
+
+
+def respond_range(caching_headers, ranges, size, path=None, content=None, streamer=filestream):
+    """
+    206 with a single range as body / stream, or multiple ranges as `multipart/byteranges`
+    """
+    headers = {k: v for k, v in caching_headers.items() if k not in {"content-length", "content-type"}}
+
+    if len(ranges) == 1:
+        offset, length = ranges[0]
+        headers["content-range"] = f"bytes {offset}-{offset + length - 1}/{size}"
+        headers["content-length"] = str(length)
+        if "content-type" in caching_headers:
+            headers["content-type"] = caching_headers["content-type"]
+        if content is not None:
+            return {"status": 206, "body": content[offset : offset + length], "headers": headers}
+        response = streamer(path, headers=headers, offset=offset, length=length)
+        response["status"] = 206
+        return response
+
+    if content is not None:
+
+        async def read_part(offset, length):
+            yield content[offset : offset + length]
+
+    else:
+
+        async def read_part(offset, length):
+            async for chunk in streamer(path, offset=offset, length=length)["stream"]:
+                yield chunk
+
+    content_type = caching_headers.get("content-type") or guess_type(path or "")[0] or "application/octet-stream"
+    multipart_headers, stream = _multipart_byteranges(ranges, size, content_type, read_part)
+    headers.update(multipart_headers)
+    return {"status": 206, "body": b"", "stream": stream, "headers": headers}
+
+
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz", "zstd": ".zst"}
+
+
+def negotiate_encodings(accept_encoding, available):
+    """
+    :return: the encodings of `available` (in that order), the client accepts according to `accept_encoding`
+    """
+    accepted, rejected = set(), set()
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        name, params = name.strip().lower(), params.strip().lower()
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        (accepted if quality > 0 else rejected).add(name)
+    return [
+        encoding for encoding in available if encoding in accepted or ("*" in accepted and encoding not in rejected)
+    ]
+
+
+def precompress_static(static_folder, min_size=256, level=9):
+    """
+    writes a gzip-sidecar (`<file>.gz`) next to every file in `static_folder` (recursively), that is at least
+    `min_size` bytes large and gets smaller when compressed. Up-to-date sidecars are kept.
+
+    :return: the paths of the written sidecars
+    """
+    compressed_suffixes = tuple(PRECOMPRESSED_SUFFIXES.values())
+    written = []
+    for directory, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            sidecar = path + PRECOMPRESSED_SUFFIXES["gzip"]
+            if filename.endswith(compressed_suffixes) or os.path.getsize(path) < min_size:
+                continue
+            if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+                continue
+
+            with open(path, "rb") as source:
+                content = source.read()
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip-container
+            compressed = compressor.compress(content) + compressor.flush()
+            if len(compressed) >= len(content):
+                continue
+            with open(sidecar, "wb") as target:
+                target.write(compressed)
+            written.append(sidecar)
+    return written
+
+
+class CachedFile:
+    __slots__ = ("content", "headers", "mtime", "size", "checked_at")
+
+    def __init__(self, content, headers, fstat, checked_at):
+        self.content = content
+        self.headers = headers
+        self.mtime = fstat.st_mtime
+        self.size = fstat.st_size
+        self.checked_at = checked_at
+
+
+class StaticFileCache:
+    """
+    LRU-cache for small static files (content + precomputed headers), bounded by the summed size of the
+    cached contents. Entries are revalidated with a `stat` at most every `revalidate_s` seconds.
+    """
+
+    def __init__(self, max_bytes, max_file_size=256 * 1024, revalidate_s=1.0):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate_s = revalidate_s
+        self.cached_bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def accepts(self, fstat):
+        return fstat.st_size <= min(self.max_file_size, self.max_bytes)
+
+    def get(self, path):
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+
+        now = time.monotonic()
+        if now - entry.checked_at > self.revalidate_s:
+            try:
+                fstat = os.stat(path)
+            except OSError:
+                fstat = None
+            if fstat is None or (fstat.st_mtime, fstat.st_size) != (entry.mtime, entry.size):
+                self.discard(path)
+                return None
+            entry.checked_at = now
+
+        self._entries.move_to_end(path)
+        return entry
+
+    def put(self, path, content, headers, fstat):
+        self.discard(path)
+        entry = self._entries[path] = CachedFile(content, headers, fstat, time.monotonic())
+        self.cached_bytes += len(content)
+        while self.cached_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.cached_bytes -= len(evicted.content)
+        return entry
+
+    def discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.cached_bytes -= len(entry.content)
+
+
+class StaticFileIndex:
+    """
+    in-memory table `<url-path relative to root>` -> `(absolute path, stat)` of all files below `root`, so
+    static-file lookups don't hit the file-system. With `rescan_s`, the table is rebuilt in the background
+    (in a thread) when it is older than that, `invalidate` rebuilds it immediately. With `revalidate_s`, the
+    stat of a found file is refreshed when it is older than that (like `StaticFileCache.get`), so the headers
+    built from it match the file actually read.
+    """
+
+    def __init__(self, root, rescan_s=None, revalidate_s=None):
+        self.root = root
+        self.rescan_s = rescan_s
+        self.revalidate_s = revalidate_s
+        self.files = {}
+        self.scanned_at = 0.0
+        self._checked_at = {}
+        self._rescan = None
+        self.invalidate()
+
+    def __len__(self):
+        return len(self.files)
+
+    def scan(self):
+        files = {}
+        for directory, _, filenames in os.walk(self.root):
+            relative_dir = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    fstat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(fstat.st_mode):
+                    files[filename if relative_dir == "." else f"{relative_dir}/{filename}"] = (path, fstat)
+        return files
+
+    def invalidate(self):
+        self.files = self.scan()
+        self.scanned_at = time.monotonic()
+        self._checked_at = {}
+
+    async def _rescan_in_background(self):
+        try:
+            self.files = await get_event_loop().run_in_executor(None, self.scan)
+            self.scanned_at = time.monotonic()
+            self._checked_at = {}
+        finally:
+            self._rescan = None
+
+    def _revalidate(self, name, indexed, now):
+        path, _ = indexed
+        try:
+            fstat = os.stat(path)
+        except OSError:
+            fstat = None
+        if fstat is None or not stat.S_ISREG(fstat.st_mode):
+            self.files.pop(name, None)
+            return None
+        self._checked_at[name] = now
+        indexed = self.files[name] = (path, fstat)
+        return indexed
+
+    def lookup(self, name):
+        now = time.monotonic()
+        if self.rescan_s is not None and self._rescan is None and now - self.scanned_at > self.rescan_s:
+            self._rescan = ensure_future(self._rescan_in_background())
+        indexed = self.files.get(name)
+        if indexed is not None and self.revalidate_s is not None:
+            if now - self._checked_at.get(name, self.scanned_at) > self.revalidate_s:
+                return self._revalidate(name, indexed, now)
+        return indexed
+
+
+async def _load_into_cache(cache, path, fstat, caching_headers):
+    async with aiofiles.open(path, "rb") as afile:
+        content = await afile.read()
+    headers = dict(caching_headers, **{"content-length": str(len(content))})
+    content_type, _ = guess_type(path)
+    if content_type:
+        headers.setdefault("content-type", content_type)
+    return cache.put(path, content, headers, fstat)
+
+
+def respond_file(request, caching_headers, path=None, content=None, streamer=filestream):
+    """
+    304 when the client has the file cached already, 206 / 416 for `range`-requests, otherwise the file -
+    from `content` when provided, else streamed from `path`.
+    """
+    client_headers = request.get("headers", {})
+    client_caching_headers = extract_matching_cache(client_headers)
+    if client_caching_headers and client_caching_headers.items() <= caching_headers.items():
+        return respond_not_modified(dict(caching_headers))
+
+    range_header = client_headers.get("range")
+    if range_header and request["method"] == "GET" and if_range_matches(client_headers, caching_headers):
+        size = len(content) if content is not None else int(caching_headers["content-length"])
+        ranges = parse_range(range_header, size)
+        if ranges == []:
+            return respond_range_not_satisfiable(size)
+        if ranges is not None:
+            return respond_range(caching_headers, ranges, size, path=path, content=content, streamer=streamer)
+
+    if content is not None:
+        return {"status": 200, "body": content, "headers": dict(caching_headers)}
+    return streamer(path, headers=dict(caching_headers))
+
+
+def _static_file_server(
+    static_folder,
+    root_path=".",
+    use_mmap=False,
+    cache_max_bytes=0,
+    cache_max_file_size=256 * 1024,
+    cache_revalidate_s=1.0,
+    precompressed=(),
+    index=False,
+    index_rescan_s=None,
+):
+    """
+    :return: coroutine-function `serve(request, path)`, returning the response for the file at `path`
+        (relative to the static-folder) or None, when there is no such file
+    """
+    streamer = mmap_filestream if use_mmap else filestream
+    cache = StaticFileCache(cache_max_bytes, cache_max_file_size, cache_revalidate_s) if cache_max_bytes else None
+    unknown_encodings = set(precompressed) - PRECOMPRESSED_SUFFIXES.keys()
+    if unknown_encodings:
+        raise ValueError(f"unknown precompressed encodings: {unknown_encodings}")
     static_folder = os.path.split(static_folder)
     root_to_check_against = os.path.abspath(os.path.join(root_path, *static_folder))
 
     if not validate_dir_path(root_to_check_against):
         raise NotADirectoryError(f"the provided path <{root_to_check_against}> is not a directory!")
+    static_index = StaticFileIndex(root_to_check_against, index_rescan_s, cache_revalidate_s) if index else None
+
+    def file_variants(request, requested_path):
+        if not precompressed:
+            return [(requested_path, None)]
+        accept_encoding = request.get("headers", {}).get("accept-encoding", "")
+        encodings = negotiate_encodings(accept_encoding, precompressed) if accept_encoding else []
+        return [(requested_path + PRECOMPRESSED_SUFFIXES[enc], enc) for enc in encodings] + [(requested_path, None)]
+
+    async def respond_from_disk(request, requested_path, path, encoding, fstat=None):
+        fstat = fstat if fstat is not None else await astat(path)
+        caching_headers = make_caching_headers(fstat)
+        if precompressed:
+            caching_headers["vary"] = "accept-encoding"
+        if encoding is not None:
+            caching_headers["content-encoding"] = encoding
+            caching_headers["content-type"] = guess_type(requested_path)[0] or "application/octet-stream"
+
+        if cache is not None and cache.accepts(fstat):
+            entry = await _load_into_cache(cache, path, fstat, caching_headers)
+            return respond_file(request, entry.headers, content=entry.content)
+        return respond_file(request, caching_headers, path=path, streamer=streamer)
+
+    async def serve(request, raw_path):
+        if "../" in raw_path:
+            return respond404()
+
+        if static_index is not None:
+            for name, encoding in file_variants(request, raw_path.lstrip("/")):
+                indexed = static_index.lookup(name)
+                if indexed is not None:
+                    path, fstat = indexed
+                    entry = cache.get(path) if cache is not None else None
+                    if entry is not None:
+                        return respond_file(request, entry.headers, content=entry.content)
+                    return await respond_from_disk(request, name, path, encoding, fstat)
+            return None
+
+        requested_path = os.path.abspath(os.path.join(root_path, *static_folder, re.sub("^[/]*", "", raw_path)))
+        if not requested_path.startswith(root_to_check_against):
+            return None
+
+        for path, encoding in file_variants(request, requested_path):
+            entry = cache.get(path) if cache is not None else None
+            if entry is not None:
+                return respond_file(request, entry.headers, content=entry.content)
+            if file_exists(path):
+                return await respond_from_disk(request, requested_path, path, encoding)
+        return None
+
+    serve.static_index = static_index
+    return serve
+
+
+def normalize_mount(mount):
+    return "/" + mount.strip("/") + "/" if mount.strip("/") else "/"
+
+
+def wrap_static(
+    static_folder,
+    root_path=".",
+    use_mmap=False,
+    cache_max_bytes=0,
+    cache_max_file_size=256 * 1024,
+    cache_revalidate_s=1.0,
+    precompressed=(),
+    index=False,
+    index_rescan_s=None,
+    mount="/",
+):
+    """
+    :param cache_max_bytes: when > 0, files up to `cache_max_file_size` bytes are served from an in-memory
+        LRU-cache of this size. Cached files (and the stats of indexed files) are revalidated at most every
+        `cache_revalidate_s` seconds.
+    :param precompressed: content-encodings (in order of preference, e.g. `("br", "gzip")`) to look for as
+        sidecar-files (`<file>.br`, `<file>.gz`). They are served, when the client accepts the encoding.
+    :param index: when True, the folder is indexed once (see `StaticFileIndex`) and requests are matched
+        against the index instead of the file-system. The index is rescanned every `index_rescan_s` seconds
+        (when provided) and can be rebuilt with `<middleware>.static_index.invalidate()`.
+    :param mount: url-prefix the folder is served under (e.g. `/assets/`). Requests with other paths are
+        passed on to the next middleware right away.
+    """
+    serve = _static_file_server(
+        static_folder,
+        root_path,
+        use_mmap,
+        cache_max_bytes,
+        cache_max_file_size,
+        cache_revalidate_s,
+        precompressed,
+        index,
+        index_rescan_s,
+    )
+    mount = normalize_mount(mount)
+    strip = len(mount) - 1
 
     def wrap_static_files(next_middleware):
         async def _handle_request(handler, request):
-            if request["method"] not in {"GET", "HEAD"}:
+            path = request["path"]
+            if not path.startswith(mount) or request["method"] not in {"GET", "HEAD"}:
                 return await next_middleware(handler, request)
 
-            raw_path = request["path"]
-            if "../" in raw_path:
-                return respond404()
+            response = await serve(request, path[strip:])
+            return await next_middleware(handler, request) if response is None else response
+
+        return _handle_request
+
+    wrap_static_files.static_index = serve.static_index
+    return wrap_static_files
+
 
-            requested_path = os.path.abspath(os.path.join(root_path, *static_folder, re.sub("^[/]*", "", raw_path)))
-            if not (requested_path.startswith(root_to_check_against) and file_exists(requested_path)):
+def wrap_static_mounts(mounts, root_path=".", **options):
+    """
+    serves multiple static-folders in one middleware. The longest matching prefix decides, which folder a
+    request is served from.
+
+    :param mounts: mapping url-prefix -> static-folder, e.g. `{"/assets/": "static/assets", "/": "public"}`
+    :param options: keyword-arguments of `wrap_static` (applied to all mounts)
+    """
+    normalized = sorted(
+        ((normalize_mount(mount), folder) for mount, folder in mounts.items()), key=lambda m: -len(m[0])
+    )
+    servers = [
+        (mount, len(mount) - 1, _static_file_server(folder, root_path, **options)) for mount, folder in normalized
+    ]
+
+    def wrap_static_mounted_files(next_middleware):
+        async def _handle_request(handler, request):
+            if request["method"] not in {"GET", "HEAD"}:
                 return await next_middleware(handler, request)
 
-            fstat = await astat(requested_path)
+            path = request["path"]
+            for mount, strip, serve in servers:
+                if path.startswith(mount):
+                    response = await serve(request, path[strip:])
+                    return await next_middleware(handler, request) if response is None else response
+            return await next_middleware(handler, request)
+
+        return _handle_request
+
+    wrap_static_mounted_files.static_indexes = {mount: serve.static_index for mount, _, serve in servers}
+    return wrap_static_mounted_files
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def fingerprint_name(name, content_hash):
+    """
+    `app.min.js` -> `app.min.<content_hash>.js`
+    """
+    directory, _, filename = name.rpartition("/")
+    stem, dot, extension = filename.rpartition(".")
+    fingerprinted = f"{stem}.{content_hash}.{extension}" if dot and stem else f"{filename}.{content_hash}"
+    return f"{directory}/{fingerprinted}" if directory else fingerprinted
+
 
-            caching_headers = make_caching_headers(fstat)
-            client_caching_headers = extract_matching_cache(request.get("headers", {}))
+def _hash_file(path, chunk_size=1024 * 1024):
+    digest = sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-            if client_caching_headers and client_caching_headers.items() <= caching_headers.items():
-                return respond_not_modified(caching_headers)
-            else:
-                return filestream(requested_path, headers=caching_headers)
+
+class AssetManifest:
+    """
+    maps the files of a static-folder (logical names like `css/app.css`) to urls containing a hash of their
+    content (`<mount>css/app.3f9a1c02.css`). Use `url` to emit these urls and `wrap_assets` to serve them.
+    The folder is hashed when the manifest is created (and on `rebuild`), so files must not change afterwards.
+    """
+
+    def __init__(self, static_folder, root_path=".", mount="/", hash_length=8):
+        self.root = os.path.abspath(os.path.join(root_path, static_folder))
+        if not validate_dir_path(self.root):
+            raise NotADirectoryError(f"the provided path <{self.root}> is not a directory!")
+        self.mount = normalize_mount(mount)
+        self.hash_length = hash_length
+        self.urls = {}
+        self._assets = {}
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.urls)
+
+    def rebuild(self):
+        urls, assets = {}, {}
+        for name, (path, fstat) in StaticFileIndex(self.root).files.items():
+            content_hash = _hash_file(path)
+            url = self.mount + fingerprint_name(name, content_hash[: self.hash_length])
+            headers = dict(
+                make_caching_headers(fstat), **{"etag": content_hash, "cache-control": IMMUTABLE_CACHE_CONTROL}
+            )
+            content_type, _ = guess_type(path)
+            if content_type:
+                headers["content-type"] = content_type
+            urls[name] = url
+            assets[url] = (path, headers)
+        self.urls, self._assets = urls, assets
+
+    def url(self, name):
+        """
+        :return: the fingerprinted url of the asset `name` (relative to the static-folder, e.g. `css/app.css`)
+        """
+        return self.urls[name.lstrip("/")]
+
+    def lookup(self, url):
+        """
+        :return: (path, headers) of the asset with the fingerprinted `url` or None
+        """
+        return self._assets.get(url)
+
+
+def wrap_assets(manifest, use_mmap=False):
+    """
+    serves the fingerprinted urls of `manifest` with `cache-control: public, max-age=31536000, immutable`
+    and an etag derived from the content. All other requests are passed on to the next middleware.
+    """
+    streamer = mmap_filestream if use_mmap else filestream
+
+    def wrap_fingerprinted_assets(next_middleware):
+        async def _handle_request(handler, request):
+            asset = manifest.lookup(request["path"]) if request["method"] in {"GET", "HEAD"} else None
+            if asset is None:
+                return await next_middleware(handler, request)
+            path, headers = asset
+            return respond_file(request, headers, path=path, streamer=streamer)
 
         return _handle_request
 
-    return wrap_static_files
+    return wrap_fingerprinted_assets
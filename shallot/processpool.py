@@ -0,0 +1,164 @@
+from asyncio import get_event_loop, wrap_future, CancelledError
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
+from importlib import import_module
+from inspect import iscoroutinefunction
+from multiprocessing.shared_memory import SharedMemory
+from .ring import read_body
+
+# keys of the request, that can not (or should not) be transferred to another process
+_LOCAL_ONLY_KEYS = {"body", "body_stream", "config", "state", "extensions", "deadline"}
+
+
+def _write_shared(data):
+    shared = SharedMemory(create=True, size=len(data))
+    try:
+        shared.buf[: len(data)] = data
+    finally:
+        shared.close()
+    return shared.name, len(data)
+
+
+def _read_shared(reference, unlink=False):
+    name, size = reference
+    shared = SharedMemory(name=name)
+    try:
+        return bytes(shared.buf[:size])
+    finally:
+        shared.close()
+        if unlink:
+            shared.unlink()
+
+
+def _unlink_shared(reference):
+    shared = SharedMemory(name=reference[0])
+    shared.close()
+    shared.unlink()
+
+
+def _discard_call(shared_body, future):
+    """
+    done-callback of an abandoned worker-call: nobody reads its response, so the shared-memory of the
+    request- and response-body is freed here, once the worker is done with it.
+    """
+    if shared_body is not None:
+        _unlink_shared(shared_body)
+    if future.cancelled() or future.exception() is not None:
+        return
+    response = future.result()
+    if response.get("shared_body"):
+        _unlink_shared(response["body"])
+
+
+def _resolve_handler(reference):
+    module_name, qualname = reference
+    handler = import_module(module_name)
+    for name in qualname.split("."):
+        handler = getattr(handler, name)
+    while getattr(handler, "__shallot_cpu_bound__", False):
+        handler = handler.__wrapped__
+    return handler
+
+
+def _run_in_process(reference, request, args, body, shared_memory_threshold):
+    """
+    executed in the worker-process: request- and response-bodies larger than the threshold are transferred
+    via shared-memory, everything else gets pickled.
+    """
+    request["body"] = _read_shared(body) if isinstance(body, tuple) else body
+    response = _resolve_handler(reference)(request, *args)
+    response_body = response.get("body")
+    if response_body and len(response_body) >= shared_memory_threshold:
+        response["body"] = _write_shared(response_body)
+        response["shared_body"] = True
+    return response
+
+
+class ProcessHandlerPool:
+    """
+    process-pool for cpu-bound handlers (see `cpu_bound`). It is started / stopped by the lifespan of
+    `build_server(..., process_workers=N)` or - when not started - lazily on the first call.
+    """
+
+    def __init__(self, shared_memory_threshold=64 * 1024):
+        self.shared_memory_threshold = shared_memory_threshold
+        self._executor = None
+
+    def start(self, max_workers=None):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(self, reference, request, args):
+        self.start()
+        body = await read_body(request)
+        portable = {k: v for k, v in request.items() if k not in _LOCAL_ONLY_KEYS}
+        if "headers" in portable:
+            portable["headers"] = dict(portable["headers"])
+
+        shared_body = _write_shared(body) if len(body) >= self.shared_memory_threshold else None
+        future = self._executor.submit(
+            _run_in_process, reference, portable, args, shared_body or body, self.shared_memory_threshold
+        )
+        try:
+            response = await wrap_future(future)
+        except CancelledError:
+            future.add_done_callback(partial(_discard_call, shared_body))
+            raise
+        except BaseException:
+            if shared_body is not None:
+                _unlink_shared(shared_body)
+            raise
+        if shared_body is not None:
+            _unlink_shared(shared_body)
+
+        if response.pop("shared_body", False):
+            response["body"] = _read_shared(response["body"], unlink=True)
+        return response
+
+
+process_pool = ProcessHandlerPool()
+
+
+def with_process_pool(on_start, on_stop, max_workers=None):
+    """
+    :return: lifespan-callbacks (on_start, on_stop) starting `process_pool` before `on_start` and
+    shutting it down after `on_stop`
+    """
+
+    async def start_pool_then(context):
+        process_pool.start(max_workers)
+        return await on_start(context)
+
+    async def stop_pool_after(context):
+        try:
+            return await on_stop(context)
+        finally:
+            # waits on the calls still running (e.g. of cancelled requests) - without blocking the event-loop
+            await get_event_loop().run_in_executor(None, process_pool.shutdown)
+
+    return start_pool_then, stop_pool_after
+
+
+def cpu_bound(handler):
+    """
+    run a synchronous, module-level handler in `process_pool` instead of the event-loop. The handler gets a
+    copy of the request without `config`, `body_stream` and other process-local data.
+    """
+    if iscoroutinefunction(handler):
+        raise TypeError(f"cpu_bound handlers must be synchronous functions, got: {handler}")
+    if "<locals>" in handler.__qualname__:
+        raise TypeError(f"cpu_bound handlers must be importable (module-level) functions, got: {handler}")
+
+    reference = (handler.__module__, handler.__qualname__)
+
+    @wraps(handler)
+    async def run_in_process(request, *args):
+        return await process_pool.run(reference, request, args)
+
+    run_in_process.__shallot_cpu_bound__ = True
+    return run_in_process
@@ -1,5 +1,25 @@
 import aiofiles
 import json as pyjson
+import mmap
+import os
+from asyncio import Semaphore, get_event_loop
+
+_open_files = {"limit": 512, "loop": None, "semaphore": None}
+
+
+def set_max_open_files(limit):
+    """
+    global cap on the files concurrently opened by `filestream` / `mmap_filestream`. Streams exceeding the
+    limit wait until another stream has finished.
+    """
+    _open_files.update({"limit": limit, "loop": None, "semaphore": None})
+
+
+def _open_files_semaphore():
+    loop = get_event_loop()
+    if _open_files["loop"] is not loop:
+        _open_files.update({"loop": loop, "semaphore": Semaphore(_open_files["limit"])})
+    return _open_files["semaphore"]
 
 
 def respond404(message="Not Found"):
@@ -10,24 +30,94 @@ def respond400(message=""):
     return text(message, status=400)
 
 
+def respond413(message="Payload Too Large"):
+    return text(message, status=413)
+
+
+def respond503(message="Service Unavailable", retry_after_s=None):
+    response = text(message, status=503)
+    if retry_after_s is not None:
+        response["headers"]["retry-after"] = str(retry_after_s)
+    return response
+
+
+def respond504(message="Gateway Timeout"):
+    return text(message, status=504)
+
+
 def respond_not_modified(headers):
     msg = b"Not Modified"
     headers["content-length"] = str(len(msg))
     return {"status": 304, "body": msg, "headers": headers}
 
 
-def filestream(path, headers=None, chunk_size=4096):
+def _file_response(path, headers, stream, offset, length):
+    # "file": servers supporting the pathsend- / zerocopysend-extension get the file instead of the stream, as
+    # long as "stream" is still "file_stream" (middlewares rewriting the stream should remove "file" anyway)
+    response = {"status": 200, "body": b"", "stream": stream, "headers": headers, "file": path, "file_stream": stream}
+    if offset or length is not None:
+        response["file_range"] = (offset, length)
+    return response
+
+
+def filestream(path, headers=None, chunk_size=4096, offset=0, length=None):
+    """
+    streams the file at `path`, starting at byte `offset`. When `length` is provided, at most `length`
+    bytes are streamed.
+    """
+    headers = {} if headers is None else headers
+
+    async def streamer():
+        async with _open_files_semaphore():
+            async with aiofiles.open(path, "rb") as afile:
+                if offset:
+                    await afile.seek(offset)
+                remaining = length
+                while True:
+                    to_read = chunk_size if remaining is None else min(chunk_size, remaining)
+                    content = await afile.read(to_read)
+                    yield content
+                    if remaining is not None:
+                        remaining -= len(content)
+                    if len(content) < to_read or remaining == 0:
+                        break
+
+    return _file_response(path, headers, streamer(), offset, length)
+
+
+def mmap_filestream(path, headers=None, min_chunk_size=64 * 1024, max_chunk_size=1024 * 1024, offset=0, length=None):
+    """
+    streams the file as `memoryview`-slices of a memory-map, without a thread-hop per chunk. The chunks start
+    with `min_chunk_size` and double up to `max_chunk_size`. Reading happens on page-faults in the event-loop,
+    so this fits files that are (mostly) in the page-cache. `offset` / `length` work like in `filestream`.
+    """
     headers = {} if headers is None else headers
 
     async def streamer():
-        async with aiofiles.open(path, "rb") as afile:
-            while True:
-                content = await afile.read(chunk_size)
-                yield content
-                if len(content) < chunk_size:
-                    break
-
-    return {"status": 200, "body": b"", "stream": streamer(), "headers": headers}
+        async with _open_files_semaphore():
+            with open(path, "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            if mapped is None:
+                yield b""
+                return
+
+            view = memoryview(mapped)
+            try:
+                end = size if length is None else min(size, offset + length)
+                position, chunk_size = offset, min_chunk_size
+                while position < end:
+                    yield view[position : min(position + chunk_size, end)]
+                    position += chunk_size
+                    chunk_size = min(chunk_size * 2, max_chunk_size)
+            finally:
+                view.release()
+                try:
+                    mapped.close()
+                except BufferError:  # chunks still referenced (by the server) -> closed when garbage-collected
+                    pass
+
+    return _file_response(path, headers, streamer(), offset, length)
 
 
 def text(body="", status=200, encoding="utf-8"):
@@ -1,9 +1,13 @@
-from collections import defaultdict
-from asyncio import wait_for, Event
+from collections import defaultdict, deque, OrderedDict
+from collections.abc import Mapping
+from asyncio import wait, wait_for, ensure_future, get_event_loop, current_task, Event, CancelledError
+from asyncio import TimeoutError as AsyncTimeoutError
+import os
 import sys
-from itertools import chain
 import logging
 from functools import partial
+from .response import respond413, respond503, respond504, ws_close
+from .threadpool import ensure_async, sync_pool
 
 __pytest__ = hasattr(sys, "_pytest_shallot_")
 
@@ -16,6 +20,8 @@ def _reset_ring_state():
         "lifetime": "No lifecyclemanagement provided from server.",
         "startup_event": None,
         "user_config": {},
+        "in_flight": set(),
+        "draining": False,
     }
 
 
@@ -41,59 +47,446 @@ async def _wait_on_completed_startup():
     await _ring_state["startup_event"].wait()
 
 
-def unicode2(xys, encoding="utf-8"):
-    x, y = xys
-    return (x.decode(encoding), y.decode(encoding))
+def _is_draining():
+    return _ring_state["draining"]
 
 
-def lowercase_key(xys):
-    x, y = xys
-    return (x.lower(), y)
+async def drain_in_flight(drain_timeout_s, admission=None):
+    """
+    stop accepting new requests, wait up to `drain_timeout_s` on the running http-requests and websocket-
+    connections and cancel the remaining ones. Requests queued by `admission` get shed.
+    """
+    _ring_state["draining"] = True
+    _ring_state["lifetime"] = "draining"
+    if admission is not None:
+        admission.shed_queued()
+    in_flight = set(_ring_state["in_flight"])
+    if not in_flight:
+        return
+    _, pending = await wait(in_flight, timeout=drain_timeout_s)
+    if pending:
+        logging.warning(f"cancel {len(pending)} request(s) still running after drain-timeout")
+        for task in pending:
+            task.cancel()
+        await wait(pending)
+
+
+class BodyTooLarge(Exception):
+    pass
 
 
-def make_headers_map(headers):
+class ClientDisconnected(Exception):
+    pass
+
+
+class Deadline:
+    """
+    cancel-scope without an extra task: when the loop-time `when` is reached, the current task gets cancelled
+    and leaving the scope raises `asyncio.TimeoutError`. `when=None` means no deadline.
+    """
+
+    __slots__ = ("when", "expired", "_task", "_handle")
+
+    def __init__(self, when=None):
+        self.when = when
+        self.expired = False
+        self._task = None
+        self._handle = None
+
+    @classmethod
+    def within(cls, timeout_s, parent=None):
+        """
+        deadline in `timeout_s` seconds. When an active `parent`-deadline expires earlier anyway, the returned
+        deadline does not schedule anything on its own.
+        """
+        when = None if timeout_s is None else get_event_loop().time() + timeout_s
+        if parent is not None and parent.when is not None and (when is None or parent.when <= when):
+            return cls(None)
+        return cls(when)
+
+    def remaining_s(self):
+        return None if self.when is None else max(self.when - get_event_loop().time(), 0.0)
+
+    def __enter__(self):
+        if self.when is not None:
+            self._task = current_task()
+            self._handle = get_event_loop().call_at(self.when, self._expire)
+        return self
+
+    def _expire(self):
+        self.expired = True
+        self._task.cancel()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._handle is not None:
+            self._handle.cancel()
+        if self.expired:
+            if hasattr(self._task, "uncancel"):  # python >= 3.11
+                self._task.uncancel()
+            if exc_type is CancelledError:
+                raise AsyncTimeoutError() from exc
+        return False
+
+
+class Headers(Mapping):
     """
-    all header-fields are joined here! This is against:  RFC 7230 and RFC 6265 (Coockies)
-    However: the final request will provide the original-headers-list. So this convenient is ok!
+    read-only, case-insensitive view on the ASGI-headers-list. Header-fields get decoded and cached only when
+    they are looked up. Item-access joins duplicated header-fields comma-separated (this is against: RFC 7230 and
+    RFC 6265 (Cookies), but convenient). Use `getlist` to get every single value of a header-field.
     """
-    acc = defaultdict(list)
-    for key, value in map(lambda xy: lowercase_key(unicode2(xy)), headers):
-        acc[key].append(value)
 
-    return {k: ",".join(v) for k, v in acc.items()}
+    __slots__ = ("_raw", "_values", "_joined", "_complete")
+
+    def __init__(self, headers_list):
+        self._raw = headers_list
+        self._values = {}
+        self._joined = {}
+        self._complete = False
+
+    def getlist(self, key):
+        key = key.lower()
+        values = self._values.get(key)
+        if values is not None:
+            return values
+        if self._complete:
+            return []
+        raw_key = key.encode("utf-8")
+        values = [value.decode("utf-8") for name, value in self._raw if name.lower() == raw_key]
+        self._values[key] = values
+        return values
+
+    def get(self, key, default=None):
+        values = self.getlist(key)
+        return self[key] if values else default
+
+    def __getitem__(self, key):
+        key = key.lower()
+        joined = self._joined.get(key)
+        if joined is None:
+            values = self.getlist(key)
+            if not values:
+                raise KeyError(key)
+            joined = self._joined[key] = ",".join(values)
+        return joined
+
+    def __contains__(self, key):
+        return bool(self.getlist(key))
+
+    def _index_all(self):
+        if not self._complete:
+            acc = defaultdict(list)
+            for name, value in self._raw:
+                acc[name.decode("utf-8").lower()].append(value.decode("utf-8"))
+            self._values = dict(acc)
+            self._complete = True
+        return self._values
+
+    def __iter__(self):
+        return iter(self._index_all())
+
+    def __len__(self):
+        return len(self._index_all())
+
+    def __repr__(self):
+        return f"Headers({dict(self.items())})"
 
 
-def serialize_headers(response):
-    headers = response.get("headers", {})
-    cookies = response.get("cookies", {})
-    return [(k.encode("utf-8"), v.encode("utf-8")) for k, v in chain(headers.items(), cookies.items())]
+def make_headers_map(headers):
+    """
+    the final request will provide the original-headers-list too, see: `Headers`
+    """
+    return Headers(headers)
+
+
+_MAX_ENCODED_HEADERS = 2048
+_encoded_headers = OrderedDict(
+    (name, name.encode("utf-8"))
+    for name in [
+        "content-type",
+        "content-length",
+        "content-encoding",
+        "cache-control",
+        "etag",
+        "last-modified",
+        "vary",
+        "Set-Cookie",
+        "Access-Control-Allow-Origin",
+        "text/plain; charset=utf-8",
+        "application/json; charset=utf-8",
+        "application/octet-stream",
+    ]
+)
+
+
+def encode_header(value):
+    """
+    utf-8-encodes a header-name or -value. Already encoded values are passed through, encoded strings are
+    kept in a LRU-cache (of `_MAX_ENCODED_HEADERS` entries), so frequent header-names and -values are encoded
+    only once, while per-response values (etags, dates, ...) are evicted again.
+    """
+    if isinstance(value, bytes):
+        return value
+    encoded = _encoded_headers.get(value)
+    if encoded is not None:
+        _encoded_headers.move_to_end(value)
+        return encoded
+    encoded = _encoded_headers[value] = value.encode("utf-8")
+    if len(_encoded_headers) > _MAX_ENCODED_HEADERS:
+        _encoded_headers.popitem(last=False)
+    return encoded
 
 
-async def consume_body(receive):
-    body = b""
+def serialize_headers(response):
+    """
+    `headers` and `cookies` are encoded, `raw_headers` (a list of already encoded (name, value)-tuples)
+    are appended as they are.
+    """
+    headers = response.get("headers")
+    cookies = response.get("cookies")
+    raw_headers = response.get("raw_headers")
+    if not cookies and not raw_headers:
+        return [(encode_header(k), encode_header(v)) for k, v in headers.items()] if headers else []
+
+    serialized = [(encode_header(k), encode_header(v)) for k, v in headers.items()] if headers else []
+    if cookies:  # cookie-values are mostly unique -> not worth caching
+        serialized.extend((encode_header(k), v.encode("utf-8")) for k, v in cookies.items())
+    if raw_headers:
+        serialized.extend(raw_headers)
+    return serialized
+
+
+def _count_body_size(size, chunk, max_body_size):
+    size += len(chunk)
+    if max_body_size is not None and size > max_body_size:
+        raise BodyTooLarge(f"request-body exceeds the limit of {max_body_size} bytes")
+    return size
+
+
+async def consume_body(receive, max_body_size=None):
+    chunks = []
+    size = 0
     more_body = True
 
     while more_body:
         message = await receive()
-        body += message.get("body", b"")
+        if message.get("type") == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        size = _count_body_size(size, chunk, max_body_size)
+        chunks.append(chunk)
         more_body = message.get("more_body", False)
 
+    return b"".join(chunks)
+
+
+async def stream_body(receive, max_receive_timeout_s, max_body_size=None):
+    """
+    async-iterator over the body-chunks of a http-request. Every single `receive` is bound by the timeout,
+    not the whole body (uploads can be arbitrarily large).
+    """
+    size = 0
+    more_body = True
+    while more_body:
+        with Deadline.within(max_receive_timeout_s):
+            message = await receive()
+        if message.get("type") == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        size = _count_body_size(size, chunk, max_body_size)
+        if chunk:
+            yield chunk
+        more_body = message.get("more_body", False)
+
+
+def declared_body_too_large(headers, max_body_size):
+    if max_body_size is None:
+        return False
+    try:
+        return int(headers.get("content-length", 0)) > max_body_size
+    except ValueError:
+        return False
+
+
+def make_route_resolver(default, route_overrides):
+    """
+    returns a function mapping a request-path to a setting (for example: a body-size-limit). The longest
+    route-prefix in `route_overrides` wins, otherwise `default` is used.
+    """
+    if not route_overrides:
+        return lambda path: default
+
+    prefixes = sorted(route_overrides.items(), key=lambda entry: len(entry[0]), reverse=True)
+
+    def resolve(path):
+        for prefix, value in prefixes:
+            if path.startswith(prefix):
+                return value
+        return default
+
+    return resolve
+
+
+async def read_body(request):
+    """
+    returns the body of the request as `bytes`. When the request-body is streamed, the remaining
+    chunks get consumed and joined once. The result is stored under the key `body`.
+    """
+    body = request.get("body")
+    if body is None:
+        stream = request.get("body_stream")
+        body = b"" if stream is None else b"".join([chunk async for chunk in stream])
+        request["body"] = body
     return body
 
 
-async def responde_client(send, response):
+async def responde_client(send, response, stream_buffer_size=0, stream_buffer_latency_s=None, extensions=None):
     streaming = response.get("stream")
+    # the file is only handed over, when the stream was not replaced (e.g. by a middleware) since it got created
+    sends_file = extensions and response.get("file") and response.get("file_stream") is streaming
     if not streaming:
         await _responde_client_direct(send, response)
+    elif sends_file and "file_range" not in response and "http.response.pathsend" in extensions:
+        await _responde_client_pathsend(send, response)
+    elif sends_file and "http.response.zerocopysend" in extensions:
+        await _responde_client_zerocopysend(send, response)
     else:
-        await _responde_client_chunked(send, response)
+        await _responde_client_chunked(send, response, stream_buffer_size, stream_buffer_latency_s)
+
+
+async def _responde_client_pathsend(send, response):
+    status = response["status"]
+    headers = serialize_headers(response)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.pathsend", "path": os.path.abspath(response["file"])})
+
+
+async def _responde_client_zerocopysend(send, response):
+    status = response["status"]
+    headers = serialize_headers(response)
+    message = {"type": "http.response.zerocopysend", "more_body": False}
+    offset, length = response.get("file_range", (0, None))
+    if offset:
+        message["offset"] = offset
+    if length is not None:
+        message["count"] = length
+    with open(response["file"], "rb") as file:
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send(dict(message, file=file))
+
+
+async def _next_chunk(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class _ChunkPump:
+    """
+    reads `bytestream` ahead (in one task per stream, at most `max_ahead` chunks), so the consumer can take
+    ready chunks without waiting and only needs a timed wait, when the producer actually blocks.
+    """
+
+    def __init__(self, bytestream, max_ahead=64):
+        self.chunks = deque()
+        self.done = False
+        self.error = None
+        self.max_ahead = max_ahead
+        self.ready = Event()
+        self.space = Event()
+        self.task = ensure_future(self._pump(bytestream))
+
+    async def _pump(self, bytestream):
+        try:
+            async for chunk in bytestream:
+                while len(self.chunks) >= self.max_ahead:
+                    self.space.clear()
+                    await self.space.wait()
+                self.chunks.append(chunk)
+                self.ready.set()
+        except Exception as error:
+            self.error = error
+        finally:
+            self.done = True
+            self.ready.set()
+
+    def take(self):
+        chunk = self.chunks.popleft()
+        self.space.set()
+        return chunk
+
+    async def wait_ready(self, timeout=None):
+        """
+        :return: False, when neither a chunk nor the end of the stream arrived within `timeout` seconds
+        """
+        if self.chunks or self.done:
+            return True
+        self.ready.clear()
+        try:
+            await wait_for(self.ready.wait(), timeout)
+        except AsyncTimeoutError:
+            return False
+        return True
+
+
+async def _coalesce_by_size(bytestream, buffer_size):
+    buffered, size = [], 0
+    async for chunk in bytestream:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield b"".join(buffered)
+            buffered, size = [], 0
+    if buffered:
+        yield b"".join(buffered)
 
 
-async def _responde_client_chunked(send, response):
+async def coalesce_chunks(bytestream, buffer_size, max_latency_s=None):
+    """
+    joins the chunks of `bytestream` until at least `buffer_size` bytes are buffered or - when provided -
+    `max_latency_s` seconds have passed since the first chunk was buffered.
+    """
+    if max_latency_s is None:
+        async for joined in _coalesce_by_size(bytestream, buffer_size):
+            yield joined
+        return
+
+    loop = get_event_loop()
+    pump = _ChunkPump(bytestream)
+    buffered, size, flush_at = [], 0, None
+    try:
+        while True:
+            timeout = max(flush_at - loop.time(), 0) if buffered else None
+            if not await pump.wait_ready(timeout):  # the producer blocks beyond the latency -> flush
+                yield b"".join(buffered)
+                buffered, size = [], 0
+                continue
+            if not pump.chunks:
+                if pump.error is not None:
+                    raise pump.error
+                break
+
+            chunk = pump.take()
+            if not buffered:
+                flush_at = loop.time() + max_latency_s
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size or loop.time() >= flush_at:
+                yield b"".join(buffered)
+                buffered, size = [], 0
+        if buffered:
+            yield b"".join(buffered)
+    finally:
+        pump.task.cancel()
+
+
+async def _responde_client_chunked(send, response, stream_buffer_size=0, stream_buffer_latency_s=None):
     status = response["status"]
     headers = serialize_headers(response)
     await send({"type": "http.response.start", "status": status, "headers": headers})
     bytestream = response["stream"]
+    if stream_buffer_size:
+        bytestream = coalesce_chunks(bytestream, stream_buffer_size, stream_buffer_latency_s)
     async for chunk in bytestream:
         await send({"type": "http.response.body", "body": chunk, "more_body": True})
     await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -124,7 +517,7 @@ async def _default_on_stop(scope):
     pass
 
 
-async def lifespan_handler(context, on_start, on_stop, receive, send):
+async def lifespan_handler(context, on_start, on_stop, receive, send, drain_timeout_s=10, admission=None):
     while True:
         message = await receive()
         if message["type"] == "lifespan.startup":
@@ -140,7 +533,11 @@ async def lifespan_handler(context, on_start, on_stop, receive, send):
 
         elif message["type"] == "lifespan.shutdown":
             try:
+                await drain_in_flight(drain_timeout_s, admission)
                 await on_stop(context)
+                sync_pool.shutdown()
+                if admission is not None:
+                    admission.close()
                 await send({"type": "lifespan.shutdown.complete"})
                 return
             except Exception as error:
@@ -148,64 +545,262 @@ async def lifespan_handler(context, on_start, on_stop, receive, send):
                 raise
 
 
-async def handle_request(context, handler, max_responde_timeout_s, max_receive_timeout_s, receive, send):
+async def _watch_disconnect(receive, task, disconnected):
+    """
+    after the body is consumed, the only message a server may send is `http.disconnect`.
+    """
+    message = await receive()
+    if message.get("type") == "http.disconnect":
+        disconnected.set()
+        task.cancel()
+
+
+async def _handle_disconnect(request, on_disconnect):
+    if on_disconnect is not None:
+        await on_disconnect(request)
+
+
+async def handle_request(
+    context,
+    handler,
+    max_responde_timeout_s,
+    max_receive_timeout_s,
+    receive,
+    send,
+    stream_request_body=False,
+    max_body_size=None,
+    stream_buffer_size=0,
+    stream_buffer_latency_s=None,
+    request_timeout_s=None,
+    cancel_on_disconnect=False,
+    on_disconnect=None,
+    config=None,
+):
+    """
+    :param context: the ASGI-scope, it's not modified - the request is a new dict
+    :param config: the user-config (result of `on_start`), the handlers get it as `request["config"]`
+    """
     headers_list = context.get("headers", [])
     headers = make_headers_map(headers_list)
-    body = await wait_for(consume_body(receive), max_receive_timeout_s) if not context["type"] == "websocket" else b""
-    method = context.get("method") if not context["type"] == "websocket" else "WS"
+    is_websocket = context["type"] == "websocket"
+    deadline = Deadline.within(None if is_websocket else request_timeout_s)
+    disconnected = Event() if cancel_on_disconnect else None
+    watcher = None
+    method = context.get("method") if not is_websocket else "WS"
+    response_started = None
+    if deadline.when is not None:
+        send, response_started = _track_response_start(send)
     request = {
         **context,
         "headers": headers,
-        "body": body,
         "headers_list": headers_list,
         "method": method,
+        "deadline": deadline,
+        "config": config,
     }
+    try:
+        with deadline:
+            if not is_websocket and declared_body_too_large(headers, max_body_size):
+                return await _reject_too_large(send, max_responde_timeout_s, deadline)
+
+            if is_websocket:
+                request["body"] = b""
+            elif stream_request_body:
+                request["body_stream"] = stream_body(receive, max_receive_timeout_s, max_body_size)
+            else:
+                try:
+                    with Deadline.within(max_receive_timeout_s, deadline):
+                        request["body"] = await consume_body(receive, max_body_size)
+                except BodyTooLarge:
+                    return await _reject_too_large(send, max_responde_timeout_s, deadline)
+                if cancel_on_disconnect:
+                    watcher = ensure_future(_watch_disconnect(receive, current_task(), disconnected))
+
+            try:
+                response = await handler(request)
+            except BodyTooLarge:
+                return await _reject_too_large(send, max_responde_timeout_s, deadline)
+            if callable(response):
+                await response(receive, send)
+            else:
+                with Deadline.within(max_responde_timeout_s, deadline):
+                    await responde_client(
+                        send, response, stream_buffer_size, stream_buffer_latency_s, context.get("extensions")
+                    )
+    except ClientDisconnected:
+        return await _handle_disconnect(request, on_disconnect)
+    except AsyncTimeoutError:
+        if not deadline.expired or response_started.is_set():
+            raise  # the response is already (partially) sent, the connection can only be aborted
+        return await _reject_timed_out(send, max_responde_timeout_s)
+    except CancelledError:
+        if disconnected is None or not disconnected.is_set():
+            raise
+        if hasattr(current_task(), "uncancel"):  # python >= 3.11
+            current_task().uncancel()
+        return await _handle_disconnect(request, on_disconnect)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+    if __pytest__:
+        return response
+
+
+def _track_response_start(send):
+    """
+    :return: (send, started) - `started` is set as soon as `http.response.start` is sent via the returned send
+    """
+    started = Event()
 
-    response = await handler(request)
-    if callable(response):
-        await response(receive, send)
+    async def tracking_send(message):
+        if message["type"] == "http.response.start":
+            started.set()
+        await send(message)
+
+    return tracking_send, started
+
+
+async def _reject_timed_out(send, max_responde_timeout_s):
+    response = respond504()
+    with Deadline.within(max_responde_timeout_s):
+        await responde_client(send, response)
+    if __pytest__:
+        return response
+
+
+async def _reject_too_large(send, max_responde_timeout_s, deadline=None):
+    response = respond413()
+    with Deadline.within(max_responde_timeout_s, deadline):
+        await responde_client(send, response)
+    if __pytest__:
+        return response
+
+
+async def _reject_unavailable(context, receive, send, retry_after_s=None):
+    if context["type"] == "websocket":
+        response = ws_close(1001)  # going away
+        await send(response)
     else:
-        await wait_for(responde_client(send, response), max_responde_timeout_s)
+        response = respond503(retry_after_s=retry_after_s)
+        await responde_client(send, response)
     if __pytest__:
         return response
 
 
 def build_server(
-    handler, max_responde_timeout_s=30, max_receive_timeout_s=15, on_start=_default_on_start, on_stop=_default_on_stop
+    handler,
+    max_responde_timeout_s=30,
+    max_receive_timeout_s=15,
+    on_start=_default_on_start,
+    on_stop=_default_on_stop,
+    stream_request_body=False,
+    max_body_size=None,
+    max_body_size_routes=None,
+    stream_buffer_size=0,
+    stream_buffer_latency_s=None,
+    drain_timeout_s=10,
+    admission=None,
+    sync_workers=None,
+    process_workers=None,
+    request_timeout_s=None,
+    request_timeout_routes=None,
+    cancel_on_disconnect=False,
+    on_disconnect=None,
+    asgi3=False,
 ):
-    async def wait_on_startup_then_run(func, receive, send):
-        await _wait_on_completed_startup()
-        _ring_state["user_config"]
+    """
+    :param asgi3: return a native ASGI-3 application `app(scope, receive, send)` instead of the ASGI-2
+        double-callable `app(scope)(receive, send)`
+    :param admission: optional `shallot.admission.AdmissionController` bounding the concurrent http-requests
+    :param sync_workers: size of the thread-pool running synchronous handlers (default: see ThreadPoolExecutor)
+    :param process_workers: when provided, the lifespan manages a process-pool of this size for `cpu_bound` handlers
+    :param request_timeout_s: end-to-end deadline (receive, handler, send) of http-requests, per route-prefix
+        overrides via `request_timeout_routes`. Handlers can read it from `request["deadline"]`.
+    :param cancel_on_disconnect: cancel the handler (and the response) when the client disconnects
+    :param on_disconnect: optional `async def on_disconnect(request)` called after a client disconnected
+    """
 
-        return await func(receive, send)
+    async def wait_on_startup_then_run(scope, receive, send):
+        await _wait_on_completed_startup()
+        return await run_request(scope, _ring_state["user_config"], receive, send)
 
     _reset_ring_state()
+    sync_pool.configure(sync_workers)
+    handler = ensure_async(handler)
+    if process_workers is not None:
+        from .processpool import with_process_pool
+
+        on_start, on_stop = with_process_pool(on_start, on_stop, process_workers)
+    resolve_max_body_size = make_route_resolver(max_body_size, max_body_size_routes)
+    resolve_request_timeout = make_route_resolver(request_timeout_s, request_timeout_routes)
+
+    async def run_request(scope, config, receive, send):
+        task = current_task()
+        in_flight = _ring_state["in_flight"]
+        in_flight.add(task)  # before the admission, so draining also waits on queued requests
+        admitted = False
+        try:
+            if admission is not None and scope["type"] == "http":
+                if not await admission.admit():
+                    return await _reject_unavailable(scope, receive, send, retry_after_s=admission.retry_after_s)
+                admitted = True
+                if _is_draining():
+                    return await _reject_unavailable(scope, receive, send)
+
+            path = scope.get("path", "")
+            return await handle_request(
+                scope,
+                handler,
+                max_responde_timeout_s,
+                max_receive_timeout_s,
+                receive,
+                send,
+                stream_request_body=stream_request_body,
+                max_body_size=resolve_max_body_size(path),
+                stream_buffer_size=stream_buffer_size,
+                stream_buffer_latency_s=stream_buffer_latency_s,
+                request_timeout_s=resolve_request_timeout(path),
+                cancel_on_disconnect=cancel_on_disconnect,
+                on_disconnect=on_disconnect,
+                config=config,
+            )
+        finally:
+            in_flight.discard(task)
+            if admitted:
+                admission.release()
 
     def request_start(scope):
 
         if "type" not in scope:
             raise NotImplementedError("no type in scope! error for %s" % scope)
 
-        context = scope.copy()
-        context["config"] = _ring_state["user_config"]
+        if scope["type"] in {"http", "websocket"} and _is_draining():
+            return partial(_reject_unavailable, scope)
 
-        request_handler = partial(handle_request, context, handler, max_responde_timeout_s, max_receive_timeout_s)
+        elif scope["type"] in {"http", "websocket"} and _is_startup_completed():
+            return partial(run_request, scope, _ring_state["user_config"])
 
-        if context["type"] in {"http", "websocket"} and _is_startup_completed():
-            return request_handler
-
-        elif context["type"] in {"http", "websocket"} and not _is_startup_completed():
+        elif scope["type"] in {"http", "websocket"} and not _is_startup_completed():
             logging.warning(
                 "Server processed request before start-up complete. This is against asgi-specification!"
                 + "Wait until start-up is done!"
             )
-            return partial(wait_on_startup_then_run, request_handler)
+            return partial(wait_on_startup_then_run, scope)
 
-        elif context["type"] == "lifespan":
+        context = scope.copy()
+        context["config"] = _ring_state["user_config"]
+        if context["type"] == "lifespan":
             _init_startup()
-            return partial(lifespan_handler, context, on_start, on_stop)
+            return partial(
+                lifespan_handler, context, on_start, on_stop, drain_timeout_s=drain_timeout_s, admission=admission
+            )
         else:
             logging.warning(f"scope:type: {context['type']} currently not supported")
             return noop
 
-    return request_start
+    async def app(scope, receive, send):
+        if scope.get("type") in {"http", "websocket"} and _is_startup_completed() and not _is_draining():
+            return await run_request(scope, _ring_state["user_config"], receive, send)
+        return await request_start(scope)(receive, send)
+
+    return app if asgi3 else request_start
@@ -0,0 +1,93 @@
+from asyncio import wrap_future, CancelledError
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from inspect import iscoroutinefunction, isawaitable
+from threading import Lock
+import time
+
+
+class SyncHandlerPool:
+    """
+    bounded thread-pool for synchronous (blocking) handlers. The pool is created lazily and reports its
+    queue-depth (`queued`) and the time the calls had to wait for a free thread (`max_wait_s`, `avg_wait_s`).
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def avg_wait_s(self):
+        return self.total_wait_s / self.completed if self.completed else 0.0
+
+    def configure(self, max_workers=None):
+        if max_workers != self.max_workers:
+            self.shutdown()
+            self.max_workers = max_workers
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="shallot-sync")
+        return self._executor
+
+    def _call(self, func, submitted_at):
+        waited = time.monotonic() - submitted_at
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait_s += waited
+            self.max_wait_s = max(self.max_wait_s, waited)
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, func, *args, **kwargs):
+        with self._lock:
+            self.queued += 1
+        future = self._get_executor().submit(self._call, partial(func, *args, **kwargs), time.monotonic())
+        try:
+            return await wrap_future(future)
+        except CancelledError:
+            if future.cancel():  # never started
+                with self._lock:
+                    self.queued -= 1
+            raise
+
+
+sync_pool = SyncHandlerPool()
+
+
+def is_async_callable(func):
+    while isinstance(func, partial):
+        func = func.func
+    return iscoroutinefunction(func) or iscoroutinefunction(getattr(func, "__call__", None))
+
+
+def ensure_async(handler):
+    """
+    returns async-handlers as they are. Synchronous handlers get wrapped, so they run on `sync_pool`
+    instead of blocking the event-loop.
+    """
+    if is_async_callable(handler):
+        return handler
+
+    @wraps(handler)
+    async def run_sync_handler(*args, **kwargs):
+        result = await sync_pool.run(handler, *args, **kwargs)
+        return await result if isawaitable(result) else result
+
+    return run_sync_handler
@@ -0,0 +1,146 @@
+import asyncio
+import time
+import pytest
+from shallot.admission import AdmissionController
+from shallot.ring import build_server
+
+
+async def receive_none():
+    return {"more_body": False}
+
+
+async def send_none(x):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_admits_up_to_max_in_flight_and_sheds_the_rest():
+    admission = AdmissionController(max_in_flight=2)
+    assert await admission.admit()
+    assert await admission.admit()
+    assert not await admission.admit()
+    assert admission.shed == 1
+    admission.release()
+    assert await admission.admit()
+    assert admission.in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_queued_requests_get_the_released_slot():
+    admission = AdmissionController(max_in_flight=1, max_queue=1)
+    assert await admission.admit()
+    queued = asyncio.ensure_future(admission.admit())
+    await asyncio.sleep(0)
+    assert admission.queued == 1
+    assert not await admission.admit()  # queue is full
+
+    admission.release()
+    assert await queued
+    assert admission.in_flight == 1
+    assert admission.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_slots_handed_over_together_with_the_queue_timeout_are_passed_on(monkeypatch):
+    async def wait_for_then_time_out(waiter, timeout):
+        await waiter  # release() hands the slot over, but the timeout fires in the same loop-iteration
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr("shallot.admission.wait_for", wait_for_then_time_out)
+    admission = AdmissionController(max_in_flight=1, max_queue=1, max_queue_wait_s=0.01)
+    assert await admission.admit()
+    queued = asyncio.ensure_future(admission.admit())
+    await asyncio.sleep(0)
+    admission.release()
+    assert not await queued
+    assert admission.shed == 1
+    assert admission.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_queued_requests_are_shed_after_max_queue_wait():
+    admission = AdmissionController(max_in_flight=1, max_queue=1, max_queue_wait_s=0.01)
+    assert await admission.admit()
+    assert not await admission.admit()
+    assert admission.queued == 0
+    admission.release()
+    assert admission.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_requests_are_shed_while_the_loop_lags():
+    admission = AdmissionController(max_in_flight=10, max_loop_lag_s=0.02, lag_probe_interval_s=0.01)
+    assert await admission.admit()
+    await asyncio.sleep(0.005)
+    time.sleep(0.05)  # block the loop
+    await asyncio.sleep(0.001)
+    assert admission.loop_lag_s > 0.02
+    assert not await admission.admit()
+    admission.close()
+
+
+@pytest.mark.asyncio
+async def test_server_responds_503_with_retry_after_when_request_is_not_admitted():
+    release = asyncio.Event()
+
+    async def blocking_handler(request):
+        await release.wait()
+        return {"status": 200}
+
+    server = build_server(blocking_handler, admission=AdmissionController(max_in_flight=1, retry_after_s=3))
+    running = asyncio.ensure_future(server({"type": "http"})(receive_none, send_none))
+    await asyncio.sleep(0.01)
+
+    rejected = await server({"type": "http"})(receive_none, send_none)
+    assert rejected["status"] == 503
+    assert rejected["headers"]["retry-after"] == "3"
+
+    release.set()
+    assert (await running)["status"] == 200
+    assert (await server({"type": "http"})(receive_none, send_none))["status"] == 200
+
+
+@pytest.mark.asyncio
+async def test_queued_requests_are_shed():
+    admission = AdmissionController(max_in_flight=1, max_queue=2)
+    assert await admission.admit()
+    queued = [asyncio.ensure_future(admission.admit()) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    admission.shed_queued()
+    assert [await waiter for waiter in queued] == [False, False]
+    assert admission.shed == 2
+    admission.release()
+    assert admission.in_flight == 0
+
+
+def shutdown_receiver():
+    async def receive_shutdown():
+        return {"type": "lifespan.shutdown"}
+
+    return receive_shutdown
+
+
+@pytest.mark.asyncio
+async def test_shutdown_sheds_queued_requests_and_closes_admission():
+    release = asyncio.Event()
+    handled = []
+
+    async def blocking_handler(request):
+        handled.append(request)
+        await release.wait()
+        return {"status": 200}
+
+    admission = AdmissionController(max_in_flight=1, max_queue=1, max_loop_lag_s=1)
+    server = build_server(blocking_handler, admission=admission, drain_timeout_s=1)
+    running = asyncio.ensure_future(server({"type": "http"})(receive_none, send_none))
+    queued = asyncio.ensure_future(server({"type": "http"})(receive_none, send_none))
+    await asyncio.sleep(0.01)
+    assert admission.queued == 1
+
+    shutdown = asyncio.ensure_future(server({"type": "lifespan"})(shutdown_receiver(), send_none))
+    assert (await queued)["status"] == 503
+    release.set()
+    await shutdown
+    assert (await running)["status"] == 200
+    assert len(handled) == 1
+    assert admission._probe is None
@@ -1,6 +1,6 @@
 import pytest
 import asyncio
-from shallot.ring import build_server
+from shallot.ring import build_server, Deadline
 from asyncio import TimeoutError
 
 
@@ -47,3 +47,152 @@ async def test_slow_body_receiver():
 
     with pytest.raises(TimeoutError):
         await handle_http({"type": "http"})(noop_receive, slow_body_receiver(0.9))
+
+
+def body_receiver(chunks):
+    received = []
+    messages = iter([{"body": chunk, "more_body": True} for chunk in chunks] + [{"body": b"", "more_body": False}])
+
+    async def receive():
+        message = next(messages)
+        received.append(message)
+        return message
+    return receive, received
+
+
+async def echo_handler(request):
+    return {"status": 200, "body": request["body"]}
+
+
+@pytest.mark.asyncio
+async def test_declared_too_large_body_is_rejected_without_receiving():
+    receive, received = body_receiver([b"a" * 100])
+    handle_http = build_server(echo_handler, max_body_size=10)
+    response = await handle_http({"type": "http", "headers": [(b"content-length", b"100")]})(receive, noop_sender)
+    assert response["status"] == 413
+    assert received == []
+
+
+@pytest.mark.asyncio
+async def test_too_large_body_is_rejected_while_receiving():
+    receive, received = body_receiver([b"a" * 6] * 10)
+    handle_http = build_server(echo_handler, max_body_size=10)
+    response = await handle_http({"type": "http"})(receive, noop_sender)
+    assert response["status"] == 413
+    assert len(received) == 2
+
+
+@pytest.mark.asyncio
+async def test_too_large_streamed_body_is_rejected():
+    async def read_all(request):
+        return {"status": 200, "body": b"".join([chunk async for chunk in request["body_stream"]])}
+
+    receive, received = body_receiver([b"a" * 6] * 10)
+    handle_http = build_server(read_all, max_body_size=10, stream_request_body=True)
+    response = await handle_http({"type": "http"})(receive, noop_sender)
+    assert response["status"] == 413
+    assert len(received) == 2
+
+
+@pytest.mark.asyncio
+async def test_body_size_limit_can_be_overridden_per_route():
+    handle_http = build_server(
+        echo_handler, max_body_size=10, max_body_size_routes={"/upload": 100, "/upload/tiny": 1, "/free": None}
+    )
+    for path, size, expected_status in [
+        ("/", 20, 413),
+        ("/upload/big", 60, 200),
+        ("/upload/tiny", 2, 413),
+        ("/free", 1000, 200),
+    ]:
+        receive, _ = body_receiver([b"a" * size])
+        response = await handle_http({"type": "http", "path": path})(receive, noop_sender)
+        assert response["status"] == expected_status, path
+
+
+@pytest.mark.asyncio
+async def test_slow_handler_is_bound_by_request_timeout():
+    async def slow_handler(request):
+        await asyncio.sleep(1)
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    handle_http = build_server(slow_handler, request_timeout_s=0.05)
+    response = await handle_http({"type": "http"})(noop_receive, send)
+    assert response["status"] == 504
+    assert sent[0]["type"] == "http.response.start"
+    assert sent[0]["status"] == 504
+    assert sent[-1]["type"] == "http.response.body"
+
+
+@pytest.mark.asyncio
+async def test_request_timeout_aborts_responses_that_already_started():
+    async def slow_stream():
+        yield b"first"
+        await asyncio.sleep(1)
+        yield b"never"
+
+    async def streaming_handler(request):
+        return {"status": 200, "stream": slow_stream()}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    handle_http = build_server(streaming_handler, request_timeout_s=0.05)
+    with pytest.raises(TimeoutError):
+        await handle_http({"type": "http"})(noop_receive, send)
+    assert [message.get("status") for message in sent if message["type"] == "http.response.start"] == [200]
+
+
+@pytest.mark.asyncio
+async def test_request_timeout_can_be_overridden_per_route():
+    async def slow_handler(request):
+        await asyncio.sleep(0.1)
+        return {"status": 200}
+
+    handle_http = build_server(slow_handler, request_timeout_s=0.05, request_timeout_routes={"/slow": 1})
+    response = await handle_http({"type": "http", "path": "/slow/report"})(noop_receive, noop_sender)
+    assert response["status"] == 200
+    response = await handle_http({"type": "http", "path": "/fast"})(noop_receive, noop_sender)
+    assert response["status"] == 504
+
+
+@pytest.mark.asyncio
+async def test_handlers_see_the_remaining_time_of_the_deadline():
+    async def budget_handler(request):
+        return {"status": 200, "remaining": request["deadline"].remaining_s()}
+
+    response = await build_server(budget_handler, request_timeout_s=5)({"type": "http"})(noop_receive, noop_sender)
+    assert 4 < response["remaining"] <= 5
+
+    response = await build_server(budget_handler)({"type": "http"})(noop_receive, noop_sender)
+    assert response["remaining"] is None
+
+
+@pytest.mark.asyncio
+async def test_no_extra_tasks_are_created_per_request():
+    async def count_tasks(request):
+        return {"status": 200, "tasks": len(asyncio.all_tasks())}
+
+    tasks_before = len(asyncio.all_tasks())
+    handle_http = build_server(count_tasks, request_timeout_s=5)
+    response = await handle_http({"type": "http"})(noop_receive, noop_sender)
+    assert response["tasks"] == tasks_before
+
+
+@pytest.mark.asyncio
+async def test_deadline_does_not_swallow_other_cancellations():
+    async def wait_long():
+        with Deadline.within(5):
+            await asyncio.sleep(1)
+
+    task = asyncio.ensure_future(wait_long())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
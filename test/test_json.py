@@ -78,4 +78,21 @@ async def test_a_missing_body_results_in_None_if_NOT_strict(json_middleware):
     }
     response = await json_middleware(noop)(request)
     assert "json" in response
-    assert response["json"] == None
\ No newline at end of file
+    assert response["json"] == None
+
+@pytest.mark.asyncio
+async def test_json_is_parsed_from_streamed_body(json_middleware):
+    async def noop(request):
+        return request
+
+    async def body_stream():
+        yield b'{"a": '
+        yield b'1}'
+
+    request = {
+        "headers": {"content-type": "application/json"},
+        "body_stream": body_stream()
+    }
+    response = await json_middleware(noop)(request)
+    assert response["json"] == {"a": 1}
+    assert response["body"] == b'{"a": 1}'
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+import pytest
+from multiprocessing.shared_memory import SharedMemory
+from shallot import processpool
+from shallot.processpool import cpu_bound, process_pool, ProcessHandlerPool
+from shallot.ring import build_server
+
+
+def reverse_body(request):
+    return {"status": 200, "body": request["body"][::-1], "pid": os.getpid(), "path": request.get("path")}
+
+
+def slow_reverse_body(request):
+    time.sleep(0.2)
+    return reverse_body(request)
+
+
+@cpu_bound
+def decorated_upper(request, name):
+    return {"status": 200, "body": (name + request["body"].decode()).upper().encode()}
+
+
+@pytest.fixture
+def pool():
+    yield process_pool
+    process_pool.shutdown()
+
+
+def test_only_module_level_sync_handlers_can_be_cpu_bound():
+    async def async_handler(request):
+        pass
+
+    def local_handler(request):
+        pass
+
+    with pytest.raises(TypeError):
+        cpu_bound(async_handler)
+    with pytest.raises(TypeError):
+        cpu_bound(local_handler)
+
+
+@pytest.mark.asyncio
+async def test_cpu_bound_handlers_run_in_another_process(pool):
+    response = await cpu_bound(reverse_body)({"body": b"abc", "path": "/reverse", "config": {"db": object()}})
+    assert response["body"] == b"cba"
+    assert response["pid"] != os.getpid()
+    assert response["path"] == "/reverse"
+
+
+@pytest.mark.asyncio
+async def test_decorated_handlers_get_route_arguments(pool):
+    response = await decorated_upper({"body": b"-body"}, "name")
+    assert response["body"] == b"NAME-BODY"
+
+
+@pytest.mark.asyncio
+async def test_large_bodies_are_transferred_via_shared_memory(pool, monkeypatch):
+    written, read = [], []
+
+    def spy(calls, function):
+        def spied(*args, **kwargs):
+            calls.append(args)
+            return function(*args, **kwargs)
+
+        return spied
+
+    monkeypatch.setattr(processpool, "_write_shared", spy(written, processpool._write_shared))
+    monkeypatch.setattr(processpool, "_read_shared", spy(read, processpool._read_shared))
+    body = os.urandom(ProcessHandlerPool().shared_memory_threshold * 4)
+    response = await cpu_bound(reverse_body)({"body": body})
+    assert response["body"] == body[::-1]
+    assert "shared_body" not in response
+    assert written == [(body,)]
+    assert len(read) == 1  # the response-body
+
+
+@pytest.mark.asyncio
+async def test_shared_memory_of_cancelled_calls_is_freed(pool, monkeypatch):
+    unlinked = []
+    unlink_shared = processpool._unlink_shared
+
+    def spied_unlink(reference):
+        unlinked.append(reference)
+        unlink_shared(reference)
+
+    monkeypatch.setattr(processpool, "_unlink_shared", spied_unlink)
+    body = os.urandom(ProcessHandlerPool().shared_memory_threshold * 4)
+    call = asyncio.ensure_future(cpu_bound(slow_reverse_body)({"body": body}))
+    await asyncio.sleep(0.1)
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+
+    for _ in range(50):
+        if len(unlinked) == 2:
+            break
+        await asyncio.sleep(0.05)
+    assert len(unlinked) == 2  # request- and response-body
+    for name, _ in unlinked:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
+
+
+@pytest.mark.asyncio
+async def test_lifespan_starts_and_stops_the_process_pool():
+    sent = []
+    messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message)
+
+    server = build_server(cpu_bound(reverse_body), process_workers=1)
+    await server({"type": "lifespan"})(receive, send)
+    assert sent == [{"type": "lifespan.startup.complete"}, {"type": "lifespan.shutdown.complete"}]
+    assert process_pool._executor is None
+
+
+@pytest.mark.asyncio
+async def test_lifespan_shutdown_does_not_block_the_event_loop():
+    shutdown = asyncio.Event()
+    messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+
+    async def receive():
+        message = next(messages)
+        if message["type"] == "lifespan.shutdown":
+            await shutdown.wait()
+        return message
+
+    async def receive_body():
+        return {"type": "http.request", "body": b"abc", "more_body": False}
+
+    async def send(message):
+        pass
+
+    server = build_server(cpu_bound(slow_reverse_body), process_workers=1)
+    lifespan = asyncio.ensure_future(server({"type": "lifespan"})(receive, send))
+    call = asyncio.ensure_future(server({"type": "http"})(receive_body, send))
+    await asyncio.sleep(0.05)
+    call.cancel()
+
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.ensure_future(tick())
+    shutdown.set()
+    await lifespan
+    ticker.cancel()
+    assert ticks >= 5, "the loop keeps running while the pool waits on the cancelled call"
+    assert process_pool._executor is None
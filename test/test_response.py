@@ -1,4 +1,6 @@
-from shallot.response import filestream
+from shallot.response import filestream, mmap_filestream, set_max_open_files, text, json, respond_not_modified
+from shallot.ring import serialize_headers
+import asyncio
 import inspect
 import os
 import pytest
@@ -45,3 +47,72 @@ async def test_filestream_reads_all_bytes_chunked():
                 actual += chunk
 
             assert actual == content, f"Len of actual: <{len(actual)}> and of content <{len(content)}> "
+
+
+@pytest.mark.asyncio
+async def test_mmap_filestream_yields_memoryviews_of_all_bytes():
+    for size in [0, 1, 1024, 64 * 1024, 300 * 1024 + 7]:
+        with NamedTemporaryFile() as temp:
+            content = os.urandom(size)
+            temp.write(content)
+            temp.flush()
+            fs = mmap_filestream(temp.name)
+            chunks = [chunk async for chunk in fs["stream"]]
+            assert b"".join(chunks) == content
+            assert all(isinstance(chunk, memoryview) for chunk in chunks) or size == 0
+
+
+@pytest.mark.asyncio
+async def test_mmap_filestream_chunks_grow_up_to_max_chunk_size():
+    with NamedTemporaryFile() as temp:
+        temp.write(b"x" * (200 * 1024))
+        temp.flush()
+        fs = mmap_filestream(temp.name, min_chunk_size=16 * 1024, max_chunk_size=64 * 1024)
+        sizes = [len(chunk) async for chunk in fs["stream"]]
+        assert sizes == [16 * 1024, 32 * 1024, 64 * 1024, 64 * 1024, 24 * 1024]
+
+
+@pytest.mark.asyncio
+async def test_open_files_are_capped_globally():
+    existing_path = os.path.join(__here__, "data", "testxt")
+    set_max_open_files(1)
+    try:
+        first, second = mmap_filestream(existing_path)["stream"], filestream(existing_path)["stream"]
+        await first.__anext__()
+        pending = asyncio.ensure_future(second.__anext__())
+        await asyncio.sleep(0.01)
+        assert not pending.done()
+
+        await first.aclose()
+        assert await pending
+        await second.aclose()
+    finally:
+        set_max_open_files(512)
+
+
+@pytest.mark.asyncio
+async def test_file_streams_can_start_at_an_offset():
+    content = os.urandom(10000)
+    with NamedTemporaryFile() as temp:
+        temp.write(content)
+        temp.flush()
+        for offset, length in [(0, 1), (5, None), (4095, 4097), (9000, 5000), (100, 8192)]:
+            expected = content[offset:] if length is None else content[offset : offset + length]
+            for streamer in [filestream, mmap_filestream]:
+                fs = streamer(temp.name, offset=offset, length=length)
+                assert b"".join([bytes(chunk) async for chunk in fs["stream"]]) == expected
+                assert fs["file_range"] == (offset, length)
+
+
+def test_headers_of_response_helpers_can_be_overridden():
+    for response, content_type in [
+        (text("hi"), "text/plain; charset=utf-8"),
+        (json({"a": 1}), "application/json; charset=utf-8"),
+        (respond_not_modified({"etag": "1", "content-length": "100"}), None),
+    ]:
+        assert response["headers"]["content-length"] == str(len(response["body"]))
+        assert response["headers"].get("content-type") == content_type
+        response["headers"]["content-type"] = "text/html"
+        names = [name for name, _ in serialize_headers(response)]
+        assert len(names) == len(set(names)), "no header is sent twice"
+        assert dict(serialize_headers(response))[b"content-type"] == b"text/html"
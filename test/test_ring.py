@@ -1,10 +1,14 @@
 import inspect
+import os
 import pytest
-from shallot.ring import build_server, noop, lifespan_handler
+from shallot.ring import build_server, noop, lifespan_handler, consume_body, read_body, Headers
+from shallot.ring import serialize_headers, encode_header, coalesce_chunks
+from shallot import ring
 from unittest import mock
 import asyncio
 from test import awaitable_mock
 from functools import partial
+from shallot.response import filestream
 
 
 async def receive_none():
@@ -214,4 +218,408 @@ async def test_requests_are_stacked_when_startup_is_not_completed():
     startup_f.cancel()
 
 
-     
\ No newline at end of file
+     
+
+def chunked_receiver(chunks):
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+    messages = iter(messages)
+
+    async def receive():
+        return next(messages)
+    return receive
+
+
+@pytest.mark.asyncio
+async def test_consume_body_joins_all_chunks():
+    chunks = [bytes([i % 256]) * 10 for i in range(1000)]
+    body = await consume_body(chunked_receiver(chunks))
+    assert body == b"".join(chunks)
+
+
+@pytest.mark.asyncio
+async def test_streamed_requests_provide_body_stream_instead_of_body():
+    chunks = [b"a" * 10, b"b" * 5, b"c"]
+
+    async def handler(request):
+        assert "body" not in request
+        return {"status": 200, "chunks": [chunk async for chunk in request["body_stream"]]}
+
+    server = build_server(handler, stream_request_body=True)
+    result = await server({"type": "http"})(chunked_receiver(chunks), send_none)
+    assert result["chunks"] == chunks
+
+
+@pytest.mark.asyncio
+async def test_read_body_joins_streamed_body_once():
+    chunks = [b"a" * 10, b"b" * 5, b"c"]
+
+    async def handler(request):
+        body = await read_body(request)
+        assert request["body"] is body
+        assert await read_body(request) is body
+        return {"status": 200, "read": body}
+
+    server = build_server(handler, stream_request_body=True)
+    result = await server({"type": "http"})(chunked_receiver(chunks), send_none)
+    assert result["read"] == b"".join(chunks)
+
+
+@pytest.mark.asyncio
+async def test_read_body_without_body_and_stream_is_empty():
+    assert await read_body({}) == b""
+
+
+def test_headers_are_looked_up_case_insensitive_and_lazy():
+    headers = Headers([(b"content-type", b"text/plain"), (b"X-Custom", b"1"), (b"x-custom", b"2")])
+    assert headers["Content-Type"] == "text/plain"
+    assert headers.get("X-CUSTOM") == "1,2"
+    assert headers.getlist("x-custom") == ["1", "2"]
+    assert "missing" not in headers
+    assert headers.get("missing", "default") == "default"
+    assert headers.getlist("missing") == []
+    with pytest.raises(KeyError):
+        headers["missing"]
+
+
+def test_headers_only_decode_looked_up_fields():
+    class RaiseOnDecode(bytes):
+        def decode(self, *args):
+            raise AssertionError("must not be decoded")
+
+    headers = Headers([(b"cookie", b"a=1"), (b"user-agent", RaiseOnDecode(b"test"))])
+    assert headers["cookie"] == "a=1"
+
+
+def test_headers_behave_like_a_read_only_dict():
+    headers = Headers([(b"a", b"1"), (b"b", b"2"), (b"a", b"3")])
+    assert dict(headers) == {"a": "1,3", "b": "2"}
+    assert len(headers) == 2
+    assert set(headers) == {"a", "b"}
+    assert headers == {"a": "1,3", "b": "2"}
+    assert headers.get("b") == "2"
+    with pytest.raises(TypeError):
+        headers["c"] = "4"
+
+
+def test_serialize_headers_passes_pre_encoded_headers_through():
+    raw = (b"x-pre-encoded", b"yes")
+    response = {"headers": {"content-type": b"application/json", "x-str": "1"}, "raw_headers": [raw]}
+    serialized = serialize_headers(response)
+    assert serialized == [(b"content-type", b"application/json"), (b"x-str", b"1"), raw]
+    assert serialized[-1] is raw
+
+
+def test_encoded_header_names_and_values_are_cached():
+    assert encode_header("content-type") is encode_header("content-type")
+    assert encode_header("some/new-value") is encode_header("some/new-value")
+    assert encode_header(b"bytes") == b"bytes"
+
+
+def test_hot_header_values_stay_cached_after_many_unique_values():
+    for i in range(3000):
+        encode_header(f"etag-{i}")
+        if i == 2500:
+            html = encode_header("text/html; charset=utf-8")
+        if i > 2500:
+            assert encode_header("text/html; charset=utf-8") is html
+    assert len(ring._encoded_headers) <= ring._MAX_ENCODED_HEADERS
+
+
+async def tiny_chunks(count, delay_s=0):
+    for i in range(count):
+        if delay_s:
+            await asyncio.sleep(delay_s)
+        yield b"%d," % i
+
+
+@pytest.mark.asyncio
+async def test_coalesce_chunks_joins_up_to_buffer_size():
+    chunks = [chunk async for chunk in coalesce_chunks(tiny_chunks(100), 50)]
+    assert b"".join(chunks) == b"".join([chunk async for chunk in tiny_chunks(100)])
+    assert all(len(chunk) >= 50 for chunk in chunks[:-1])
+    assert len(chunks) < 10
+
+
+@pytest.mark.asyncio
+async def test_coalesce_chunks_flushes_after_max_latency():
+    chunks = [chunk async for chunk in coalesce_chunks(tiny_chunks(5, delay_s=0.05), 1024, max_latency_s=0.01)]
+    assert chunks == [b"0,", b"1,", b"2,", b"3,", b"4,"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_chunks_with_latency_reads_ready_chunks_without_extra_tasks(monkeypatch):
+    created = []
+    monkeypatch.setattr(ring, "ensure_future", lambda coro: created.append(coro) or asyncio.ensure_future(coro))
+
+    chunks = [chunk async for chunk in coalesce_chunks(tiny_chunks(1000), 1024, max_latency_s=10)]
+    assert b"".join(chunks) == b"".join([chunk async for chunk in tiny_chunks(1000)])
+    assert all(len(chunk) >= 1024 for chunk in chunks[:-1])
+    assert len(created) == 1, "one reader per stream, not one per chunk"
+
+
+@pytest.mark.asyncio
+async def test_coalesce_chunks_with_latency_raises_errors_of_the_stream():
+    async def failing():
+        yield b"1"
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        [chunk async for chunk in coalesce_chunks(failing(), 1024, max_latency_s=10)]
+
+
+@pytest.mark.asyncio
+async def test_streamed_responses_are_coalesced_when_configured():
+    async def handler(request):
+        return {"status": 200, "stream": tiny_chunks(100)}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    server = build_server(handler, stream_buffer_size=64 * 1024)
+    await server({"type": "http"})(receive_none, send)
+    assert [message["type"] for message in sent] == ["http.response.start"] + ["http.response.body"] * 2
+    assert sent[1]["body"] == b"".join([chunk async for chunk in tiny_chunks(100)])
+
+
+def shutdown_receiver():
+    async def receive_shutdown():
+        return {"type": "lifespan.shutdown"}
+    return receive_shutdown
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_in_flight_requests_and_rejects_new_ones():
+    events = []
+
+    async def slow_handler(request):
+        await asyncio.sleep(0.1)
+        events.append("request-done")
+        return {"status": 200}
+
+    async def on_stop(context):
+        events.append("on-stop")
+
+    server = build_server(slow_handler, on_stop=on_stop, drain_timeout_s=1)
+    running = asyncio.ensure_future(server({"type": "http"})(receive_none, send_none))
+    await asyncio.sleep(0.01)
+    shutdown = asyncio.ensure_future(server({"type": "lifespan"})(shutdown_receiver(), send_none))
+    await asyncio.sleep(0.01)
+
+    rejected = await server({"type": "http"})(receive_none, send_none)
+    assert rejected["status"] == 503
+    rejected_ws = await server({"type": "websocket"})(receive_none, send_none)
+    assert rejected_ws == {"type": "websocket.close", "code": 1001}
+
+    await shutdown
+    assert (await running)["status"] == 200
+    assert events == ["request-done", "on-stop"]
+
+
+@pytest.mark.asyncio
+async def test_shutdown_cancels_requests_running_longer_than_drain_timeout():
+    async def endless_handler(request):
+        await asyncio.sleep(10)
+
+    server = build_server(endless_handler, drain_timeout_s=0.05)
+    running = asyncio.ensure_future(server({"type": "http"})(receive_none, send_none))
+    await asyncio.sleep(0.01)
+    await server({"type": "lifespan"})(shutdown_receiver(), send_none)
+    assert running.cancelled()
+
+
+def disconnecting_receiver(disconnect_after_s):
+    messages = iter([{"type": "http.request", "body": b"", "more_body": False}])
+
+    async def receive():
+        try:
+            return next(messages)
+        except StopIteration:
+            await asyncio.sleep(disconnect_after_s)
+            return {"type": "http.disconnect"}
+    return receive
+
+
+@pytest.mark.asyncio
+async def test_handler_is_cancelled_when_client_disconnects():
+    events = []
+
+    async def expensive_handler(request):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+
+    async def on_disconnect(request):
+        events.append(("on-disconnect", request["path"]))
+
+    server = build_server(expensive_handler, cancel_on_disconnect=True, on_disconnect=on_disconnect)
+    result = await asyncio.wait_for(
+        server({"type": "http", "path": "/report"})(disconnecting_receiver(0.01), send_none), timeout=1
+    )
+    assert result is None
+    assert events == ["cancelled", ("on-disconnect", "/report")]
+
+
+@pytest.mark.asyncio
+async def test_disconnect_watcher_is_stopped_after_response():
+    async def fast_handler(request):
+        return {"status": 200}
+
+    tasks_before = len(asyncio.all_tasks())
+    server = build_server(fast_handler, cancel_on_disconnect=True)
+    result = await server({"type": "http"})(disconnecting_receiver(10), send_none)
+    assert result["status"] == 200
+    await asyncio.sleep(0)
+    assert len(asyncio.all_tasks()) == tasks_before
+
+
+@pytest.mark.asyncio
+async def test_disconnect_while_receiving_the_body_does_not_call_the_handler():
+    called = []
+
+    async def handler(request):
+        called.append(request)
+        return {"status": 200}
+
+    messages = iter([{"type": "http.request", "body": b"part", "more_body": True}, {"type": "http.disconnect"}])
+
+    async def receive():
+        return next(messages)
+
+    result = await build_server(handler)({"type": "http"})(receive, send_none)
+    assert result is None
+    assert called == []
+
+
+@pytest.mark.asyncio
+async def test_asgi3_server_is_a_single_async_callable():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    server = build_server(handler_identity, asgi3=True)
+    assert inspect.iscoroutinefunction(server)
+    scope = {"type": "http", "headers": [(b"a", b"1")]}
+    result = await server(scope, receive_none, send)
+    assert result["headers"] == {"a": "1"}
+    assert result["config"] == {}
+    assert scope == {"type": "http", "headers": [(b"a", b"1")]}, "the scope is neither copied nor modified"
+    assert sent[0]["type"] == "http.response.start"
+
+
+@pytest.mark.asyncio
+async def test_asgi3_server_handles_lifespan_and_unknown_scopes():
+    async def receive_shutdown():
+        return {"type": "lifespan.shutdown"}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    server = build_server(handler_identity, asgi3=True)
+    assert await server({"type": "unknown"}, receive_none, send) is None
+    await server({"type": "lifespan"}, receive_shutdown, send)
+    assert sent == [{"type": "lifespan.shutdown.complete"}]
+
+
+def static_file_handler():
+    path = os.path.join(os.path.dirname(__file__), "data", "testxt")
+
+    async def handler(request):
+        return filestream(path, headers={"content-type": "text/plain"})
+
+    return path, handler
+
+
+async def collect_response(extensions):
+    path, handler = static_file_handler()
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            message = {**message, "file": message["file"].read()}
+        sent.append(message)
+
+    scope = {"type": "http", "extensions": extensions} if extensions is not None else {"type": "http"}
+    await build_server(handler)(scope)(receive_none, send)
+    with open(path, "rb") as testfile:
+        return sent, path, testfile.read()
+
+
+@pytest.mark.asyncio
+async def test_files_are_handed_to_servers_supporting_pathsend():
+    sent, path, _ = await collect_response({"http.response.pathsend": {}, "http.response.zerocopysend": {}})
+    assert sent[0]["type"] == "http.response.start"
+    assert sent[1:] == [{"type": "http.response.pathsend", "path": os.path.abspath(path)}]
+
+
+@pytest.mark.asyncio
+async def test_file_descriptors_are_handed_to_servers_supporting_zerocopysend():
+    sent, _, content = await collect_response({"http.response.zerocopysend": {}})
+    assert sent[1:] == [{"type": "http.response.zerocopysend", "file": content, "more_body": False}]
+
+
+@pytest.mark.asyncio
+async def test_file_ranges_use_zerocopysend_offsets_but_not_pathsend():
+    path = os.path.join(os.path.dirname(__file__), "data", "testxt")
+    with open(path, "rb") as testfile:
+        content = testfile.read()
+
+    async def handler(request):
+        return filestream(path, offset=2, length=5)
+
+    for extensions, expected_type in [
+        ({"http.response.pathsend": {}}, "http.response.body"),
+        ({"http.response.zerocopysend": {}}, "http.response.zerocopysend"),
+    ]:
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await build_server(handler)({"type": "http", "extensions": extensions})(receive_none, send)
+        assert {message["type"] for message in sent[1:]} == {expected_type}
+        if expected_type == "http.response.body":
+            assert b"".join(message["body"] for message in sent[1:]) == content[2:7]
+        else:
+            assert (sent[1]["offset"], sent[1]["count"]) == (2, 5)
+
+
+@pytest.mark.asyncio
+async def test_files_are_streamed_when_a_middleware_replaced_the_stream():
+    path, handler = static_file_handler()
+
+    async def upper(stream):
+        async for chunk in stream:
+            yield chunk.upper()
+
+    async def upper_handler(request):
+        response = await handler(request)
+        response["stream"] = upper(response["stream"])
+        return response
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    extensions = {"http.response.pathsend": {}, "http.response.zerocopysend": {}}
+    await build_server(upper_handler)({"type": "http", "extensions": extensions})(receive_none, send)
+    with open(path, "rb") as testfile:
+        content = testfile.read()
+    assert {message["type"] for message in sent[1:]} == {"http.response.body"}
+    assert b"".join(message["body"] for message in sent[1:]) == content.upper()
+
+
+@pytest.mark.asyncio
+async def test_files_are_streamed_without_server_extensions():
+    for extensions in [None, {}, {"http.response.trailers": {}}]:
+        sent, _, content = await collect_response(extensions)
+        assert {message["type"] for message in sent[1:]} == {"http.response.body"}
+        assert b"".join(message["body"] for message in sent[1:]) == content
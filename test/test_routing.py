@@ -1,4 +1,6 @@
-from shallot.middlewares.routing import build_static_router, router as _router
+import uuid
+from shallot.middlewares import apply_middleware, wrap_routes
+from shallot.middlewares.routing import build_static_router, radix_router, router as _router
 import pytest
 
 
@@ -54,3 +56,172 @@ def test_router_dispatches_to_dynamic_route(router):
 def test_router_dispatches_to_dynamic_route_ignoring_trailing_slashes(router):
     handler, args = router({"path": "/users/3/", "method": "GET"})
     assert "users/uid/3" == handler(None, args[0])
+
+
+def test_router_passes_one_argument_per_tag():
+    router = _router([("/users/{uid}/posts/{pid}", ["GET"], lambda x, uid, pid: (uid, pid))])
+    handler, args = router({"path": "/users/3/posts/7", "method": "GET"})
+    assert args == ("3", "7")
+    assert handler(None, *args) == ("3", "7")
+
+
+def test_router_dispatches_dynamic_routes_per_method():
+    router = _router(
+        [
+            ("/files/{name}", ["GET"], lambda x, name: "get " + name),
+            ("/files/{name}", ["DELETE"], lambda x, name: "delete " + name),
+            ("/{kind}/{name}", ["POST"], lambda x, kind, name: "post " + kind),
+        ]
+    )
+    for method, expected in [("GET", "get a"), ("DELETE", "delete a"), ("POST", "post files")]:
+        handler, args = router({"path": "/files/a", "method": method})
+        assert handler(None, *args) == expected
+    assert router({"path": "/files/a", "method": "PUT"}) == (None, None)
+
+
+def test_router_prefers_the_first_matching_dynamic_route():
+    router = _router(
+        [
+            ("/items/{id}.json", ["GET"], lambda x, i: "json " + i),
+            ("/items/{id}", ["GET"], lambda x, i: "item " + i),
+        ]
+    )
+    for path, expected in [("/items/3.json", "json 3"), ("/items/3xjson", "item 3xjson"), ("/items/3", "item 3")]:
+        handler, args = router({"path": path, "method": "GET"})
+        assert handler(None, *args) == expected
+
+
+def test_router_dispatches_within_large_routing_tables():
+    table = [(f"/resource{i}/{{rid}}", ["GET"], lambda x, rid, i=i: (i, rid)) for i in range(1000)]
+    router = _router(table)
+    for i in [0, 1, 500, 999]:
+        handler, args = router({"path": f"/resource{i}/abc", "method": "GET"})
+        assert handler(None, *args) == (i, "abc")
+    assert router({"path": "/resource1000/abc", "method": "GET"}) == (None, None)
+
+
+def test_radix_router_converts_typed_tags():
+    uid = uuid.uuid4()
+    router = radix_router(
+        [
+            ("/users/{uid:int}", ["GET"], lambda x, uid: ("int", uid)),
+            ("/users/{uid:uuid}", ["GET"], lambda x, uid: ("uuid", uid)),
+            ("/users/{name}", ["GET"], lambda x, name: ("str", name)),
+            ("/users/me", ["GET"], lambda x: ("static",)),
+            ("/files/{rest:path}", ["GET"], lambda x, rest: ("path", rest)),
+            ("/files/{name}/info", ["GET"], lambda x, name: ("info", name)),
+        ]
+    )
+    for path, expected in [
+        ("/users/42", ("int", 42)),
+        (f"/users/{uid}", ("uuid", uid)),
+        ("/users/peter", ("str", "peter")),
+        ("/users/me/", ("static",)),
+        ("/users/-1", ("str", "-1")),
+        ("/files/a/b/c.txt", ("path", "a/b/c.txt")),
+        ("/files/a/info", ("info", "a")),
+    ]:
+        handler, args = router({"path": path, "method": "GET"})
+        assert handler(None, *args) == expected, path
+
+    for path in ["/users", "/users/42/x", "/files"]:
+        assert router({"path": path, "method": "GET"}) == (None, None), path
+    assert router({"path": "/users/42", "method": "POST"}) == (None, None)
+
+
+def test_radix_router_passes_one_argument_per_tag():
+    router = radix_router([("/users/{uid:int}/posts/{pid}", ["GET"], lambda x, uid, pid: (uid, pid))])
+    handler, args = router({"path": "/users/3/posts/7", "method": "GET"})
+    assert args == (3, "7")
+
+
+def test_radix_router_backtracks_to_other_branches():
+    router = radix_router(
+        [
+            ("/a/{x:int}/b", ["GET"], lambda r, x: ("int", x)),
+            ("/a/{x}/c", ["GET"], lambda r, x: ("str", x)),
+        ]
+    )
+    handler, args = router({"path": "/a/1/c", "method": "GET"})
+    assert handler(None, *args) == ("str", "1")
+
+
+def test_radix_router_reports_ambiguous_and_invalid_routes():
+    ambiguous_tables = [
+        [("/users/{uid}", ["GET"], None), ("/users/{name}", ["GET", "POST"], None)],
+        [("/files/{a:path}", ["GET"], None), ("/files/{b:path}", ["GET"], None)],
+    ]
+    for table in ambiguous_tables:
+        with pytest.raises(ValueError, match="ambiguous"):
+            radix_router(table)
+
+    for route in ["/users/{uid:float}", "/files/{rest:path}/info", "/users/id-{uid}"]:
+        with pytest.raises(ValueError):
+            radix_router([(route, ["GET"], None)])
+
+    radix_router([("/users/{uid}", ["GET"], None), ("/users/{name}", ["POST"], None)])
+
+
+def test_radix_router_dispatches_within_large_routing_tables():
+    table = [(f"/resource{i}/{{rid:int}}", ["GET"], lambda x, rid, i=i: (i, rid)) for i in range(1000)]
+    router = radix_router(table)
+    for i in [0, 1, 500, 999]:
+        handler, args = router({"path": f"/resource{i}/7", "method": "GET"})
+        assert handler(None, *args) == (i, 7)
+    assert router({"path": "/resource1/abc", "method": "GET"}) == (None, None)
+
+
+@pytest.mark.asyncio
+async def test_wrap_routes_uses_the_radix_backend():
+    async def user(request, uid):
+        return {"status": 200, "body": str(uid + 1).encode()}
+
+    async def not_found(request):
+        return {"status": 404}
+
+    handler = apply_middleware(wrap_routes([("/users/{uid:int}", ["GET"], user)], backend="radix"))(not_found)
+    assert (await handler({"method": "GET", "path": "/users/41"}))["body"] == b"42"
+    assert (await handler({"method": "GET", "path": "/users/abc"}))["status"] == 404
+
+
+@pytest.mark.parametrize("make_router", [_router, radix_router])
+def test_dynamic_resolutions_are_cached(make_router):
+    router = make_router(
+        [("/", ["GET"], lambda x: "index"), ("/users/{uid}", ["GET"], lambda x, uid: "user " + uid)], cache_size=2
+    )
+    for path in ["/users/1", "/users/1/", "/users/1", "/users/2", "/", "/users/3", "/users/1"]:
+        handler, args = router({"path": path, "method": "GET"})
+        assert handler(None, *args) == ("index" if path == "/" else "user " + path.strip("/").split("/")[1])
+
+    info = router.cache_info()
+    assert (info.hits, info.misses, info.currsize, info.maxsize) == (2, 4, 2, 2), "static routes are not cached"
+
+
+@pytest.mark.parametrize("make_router", [_router, radix_router])
+def test_misses_do_not_evict_cached_routes(make_router):
+    router = make_router([("/users/{uid}", ["GET"], lambda x, uid: "user " + uid)], cache_size=1)
+    assert router({"path": "/users/1", "method": "GET"})[0] is not None
+    for index in range(10):
+        assert router({"path": f"/scan/{index}", "method": "GET"}) == (None, None)
+        assert router({"path": "/users/1", "method": "POST"}) == (None, None)
+    handler, args = router({"path": "/users/1", "method": "GET"})
+    assert handler(None, *args) == "user 1"
+
+    info = router.cache_info()
+    assert (info.hits, info.misses, info.currsize, info.maxsize) == (1, 21, 1, 1)
+
+
+def test_dynamic_resolutions_are_not_cached_by_default():
+    assert _router([("/users/{uid}", ["GET"], None)]).cache_info is None
+
+
+@pytest.mark.asyncio
+async def test_wrap_routes_exposes_the_cache_statistics():
+    async def user(request, uid):
+        return {"status": 200, "body": uid.encode()}
+
+    middleware = wrap_routes([("/users/{uid}", ["GET"], user)], cache_size=128)
+    handler = apply_middleware(middleware)(user)
+    for _ in range(3):
+        assert (await handler({"method": "GET", "path": "/users/7"}))["body"] == b"7"
+    assert (middleware.cache_info().hits, middleware.cache_info().misses) == (2, 1)
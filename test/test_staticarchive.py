@@ -0,0 +1,193 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+import pytest
+from shallot.middlewares import apply_middleware
+from shallot.middlewares.staticarchive import wrap_static_archive
+
+unhandled = {"status": 218, "body": b""}
+stored_content = b"console.log(1);"
+deflated_content = b"body { color: red; }\n" * 100
+large_content = os.urandom(300 * 1024)
+
+
+async def noop_handler(request):
+    return unhandled
+
+
+async def consume(response):
+    if "stream" not in response:
+        return response["body"]
+    return b"".join([bytes(chunk) async for chunk in response["stream"]])
+
+
+@pytest.fixture
+def zip_archive(tmp_path):
+    path = tmp_path / "static.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("dist/app.js", stored_content, compress_type=zipfile.ZIP_STORED)
+        archive.writestr("dist/css/style.css", deflated_content, compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr("dist/video.bin", large_content, compress_type=zipfile.ZIP_STORED)
+        archive.writestr("README", b"not served", compress_type=zipfile.ZIP_STORED)
+    return path
+
+
+@pytest.fixture
+def tar_archive(tmp_path):
+    path = tmp_path / "static.tar"
+    with tarfile.open(path, "w") as archive:
+        for name, content in [("app.js", stored_content), ("video.bin", large_content)]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return path
+
+
+@pytest.mark.asyncio
+async def test_stored_zip_members_are_served_from_the_archive(zip_archive):
+    middleware = wrap_static_archive(str(zip_archive), mount="/static/", member_prefix="dist/")
+    handler = apply_middleware(middleware)(noop_handler)
+    assert len(middleware.archive) == 3
+
+    response = await handler({"method": "GET", "path": "/static/app.js"})
+    assert response["status"] == 200
+    assert response["headers"]["content-type"] in {"application/javascript", "text/javascript"}
+    assert response["headers"]["content-length"] == str(len(stored_content))
+    assert await consume(response) == stored_content
+
+    large = await handler({"method": "GET", "path": "/static/video.bin"})
+    assert large["stream"], "large members are streamed"
+    assert await consume(large) == large_content
+
+    for path in ["/static/README", "/static/missing.js", "/app.js"]:
+        assert await handler({"method": "GET", "path": path}) is unhandled
+
+
+@pytest.mark.asyncio
+async def test_deflated_zip_members_are_served_as_gzip(zip_archive):
+    handler = apply_middleware(wrap_static_archive(str(zip_archive), member_prefix="dist/"))(noop_handler)
+
+    request = {"method": "GET", "path": "/css/style.css", "headers": {"accept-encoding": "gzip, br"}}
+    compressed = await handler(request)
+    assert compressed["headers"]["content-encoding"] == "gzip"
+    assert compressed["headers"]["vary"] == "accept-encoding"
+    assert compressed["headers"]["content-length"] == str(len(compressed["body"]))
+    assert gzip.decompress(compressed["body"]) == deflated_content
+
+    identity = await handler({"method": "GET", "path": "/css/style.css", "headers": {}})
+    assert "content-encoding" not in identity["headers"]
+    assert identity["body"] == deflated_content
+    assert identity["headers"]["etag"] != compressed["headers"]["etag"]
+
+
+@pytest.mark.asyncio
+async def test_deflated_members_are_decompressed_once(zip_archive):
+    middleware = wrap_static_archive(str(zip_archive), member_prefix="dist/")
+    handler = apply_middleware(middleware)(noop_handler)
+    for _ in range(3):
+        assert (await handler({"method": "GET", "path": "/css/style.css"}))["body"] == deflated_content
+    assert middleware.archive.members["css/style.css"].inflated == deflated_content
+
+
+@pytest.mark.asyncio
+async def test_large_deflated_members_are_decompressed_while_streamed(tmp_path):
+    path = tmp_path / "static.zip"
+    large_deflated = b"".join(b"line %d\n" % line for line in range(100_000))
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("data.txt", large_deflated, compress_type=zipfile.ZIP_DEFLATED)
+    middleware = wrap_static_archive(str(path), stream_threshold=4096)
+    handler = apply_middleware(middleware)(noop_handler)
+
+    response = await handler({"method": "GET", "path": "/data.txt"})
+    assert response["headers"]["content-length"] == str(len(large_deflated))
+    chunks = [bytes(chunk) async for chunk in response["stream"]]
+    assert max(map(len, chunks)) <= 4096
+    assert b"".join(chunks) == large_deflated
+    assert middleware.archive.members["data.txt"].inflated is None
+
+    ranged = await handler({"method": "GET", "path": "/data.txt", "headers": {"range": "bytes=5000-9999"}})
+    assert ranged["status"] == 206
+    assert await consume(ranged) == large_deflated[5000:10000]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream_threshold", [1000, 256 * 1024])
+async def test_highly_compressible_members_are_decompressed_completely(tmp_path, stream_threshold):
+    path = tmp_path / "static.zip"
+    zeros = bytes(5 * 1024 * 1024 + 123)
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("zeros.bin", zeros, compress_type=zipfile.ZIP_DEFLATED)
+    handler = apply_middleware(wrap_static_archive(str(path), stream_threshold=stream_threshold))(noop_handler)
+
+    response = await handler({"method": "GET", "path": "/zeros.bin"})
+    assert response["headers"]["content-length"] == str(len(zeros))
+    assert await consume(response) == zeros
+
+    ranged = await handler({"method": "GET", "path": "/zeros.bin", "headers": {"range": f"bytes={len(zeros) - 200}-"}})
+    assert await consume(ranged) == zeros[-200:]
+
+
+@pytest.mark.asyncio
+async def test_large_gzip_members_are_streamed_from_the_archive(tmp_path):
+    path = tmp_path / "static.zip"
+    content = b"".join(b"line %d\n" % line for line in range(100_000))
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("data.txt", content, compress_type=zipfile.ZIP_DEFLATED)
+    handler = apply_middleware(wrap_static_archive(str(path), stream_threshold=4096))(noop_handler)
+
+    request = {"method": "GET", "path": "/data.txt", "headers": {"accept-encoding": "gzip"}}
+    response = await handler(request)
+    assert response["headers"]["content-encoding"] == "gzip"
+    chunks = [bytes(chunk) async for chunk in response["stream"]]
+    assert max(map(len, chunks)) <= 4096
+    compressed = b"".join(chunks)
+    assert response["headers"]["content-length"] == str(len(compressed))
+    assert gzip.decompress(compressed) == content
+
+    ranged = await handler({**request, "headers": {**request["headers"], "range": "bytes=5-9000"}})
+    assert await consume(ranged) == compressed[5:9001]
+
+
+@pytest.mark.asyncio
+async def test_archive_members_support_caching_and_ranges(zip_archive):
+    handler = apply_middleware(wrap_static_archive(str(zip_archive), member_prefix="dist/"))(noop_handler)
+    etag = (await handler({"method": "GET", "path": "/app.js"}))["headers"]["etag"]
+    assert (await handler({"method": "GET", "path": "/app.js", "headers": {"if-none-match": etag}}))["status"] == 304
+
+    for path, expected in [("/app.js", stored_content), ("/video.bin", large_content)]:
+        response = await handler({"method": "GET", "path": path, "headers": {"range": "bytes=2-9"}})
+        assert response["status"] == 206
+        assert await consume(response) == expected[2:10]
+
+
+@pytest.mark.asyncio
+async def test_tar_members_are_served_from_the_archive(tar_archive):
+    handler = apply_middleware(wrap_static_archive(str(tar_archive)))(noop_handler)
+    assert await consume(await handler({"method": "GET", "path": "/app.js"})) == stored_content
+    assert await consume(await handler({"method": "GET", "path": "/video.bin"})) == large_content
+
+
+@pytest.mark.asyncio
+async def test_archives_can_be_reloaded(zip_archive):
+    middleware = wrap_static_archive(str(zip_archive), member_prefix="dist/")
+    handler = apply_middleware(middleware)(noop_handler)
+    replacement = zip_archive.with_name("static.zip.new")
+    with zipfile.ZipFile(replacement, "w") as archive:
+        archive.writestr("dist/app.js", b"console.log(2);")
+    os.replace(replacement, zip_archive)  # atomically, the memory-map of the old archive stays intact
+
+    middleware.archive.reload()
+    assert await consume(await handler({"method": "GET", "path": "/app.js"})) == b"console.log(2);"
+    assert await handler({"method": "GET", "path": "/video.bin"}) is unhandled
+
+
+def test_compressed_tar_archives_are_rejected(tmp_path):
+    path = tmp_path / "static.tar.gz"
+    with tarfile.open(path, "w:gz") as archive:
+        info = tarfile.TarInfo("app.js")
+        info.size = len(stored_content)
+        archive.addfile(info, io.BytesIO(stored_content))
+    with pytest.raises(tarfile.ReadError):
+        wrap_static_archive(str(path))
@@ -1,7 +1,11 @@
+import gzip
+import hashlib
 import os
 import inspect
 import pytest
-from shallot.middlewares.staticfiles import wrap_static
+from shallot.middlewares.staticfiles import wrap_static, StaticFileCache, parse_range
+from shallot.middlewares.staticfiles import negotiate_encodings, precompress_static, wrap_static_mounts
+from shallot.middlewares.staticfiles import AssetManifest, fingerprint_name, wrap_assets
 from shallot.middlewares import apply_middleware
 
 
@@ -71,3 +75,314 @@ async def test_static_response_have_caching_headers(staticfiles_handler):
 async def test_by_default_sym_links_are_forbidden(staticfiles_handler, linked_file):
     response = await staticfiles_handler({"method": "GET", "path": linked_file})
     assert response["status"] == 404
+
+
+@pytest.fixture
+def static_folder(tmp_path):
+    (tmp_path / "app.js").write_bytes(b"console.log(1);")
+    (tmp_path / "big.bin").write_bytes(b"x" * 2048)
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_small_files_are_served_from_memory_cache(static_folder):
+    handler = apply_middleware(wrap_static(str(static_folder), cache_max_bytes=1024, cache_revalidate_s=60))(
+        noop_handler
+    )
+    first = await handler({"method": "GET", "path": "/app.js"})
+    (static_folder / "app.js").unlink()
+    second = await handler({"method": "GET", "path": "/app.js"})
+
+    for response in [first, second]:
+        assert response["status"] == 200
+        assert response["body"] == b"console.log(1);"
+        assert "stream" not in response
+        assert response["headers"]["content-type"] in {"application/javascript", "text/javascript"}
+        assert "etag" in response["headers"]
+
+    big = await handler({"method": "GET", "path": "/big.bin"})
+    assert big["stream"], "files larger than the cache must be streamed"
+
+
+@pytest.mark.asyncio
+async def test_cached_files_are_revalidated(static_folder):
+    handler = apply_middleware(wrap_static(str(static_folder), cache_max_bytes=1024, cache_revalidate_s=0))(
+        noop_handler
+    )
+    assert (await handler({"method": "GET", "path": "/app.js"}))["body"] == b"console.log(1);"
+    (static_folder / "app.js").write_bytes(b"console.log(22);")
+    os.utime(static_folder / "app.js", (1, 1))
+    assert (await handler({"method": "GET", "path": "/app.js"}))["body"] == b"console.log(22);"
+
+
+@pytest.mark.asyncio
+async def test_cached_files_honor_browser_caches(static_folder):
+    handler = apply_middleware(wrap_static(str(static_folder), cache_max_bytes=1024))(noop_handler)
+    response = await handler({"method": "GET", "path": "/app.js"})
+    request = {"method": "GET", "path": "/app.js", "headers": {"if-none-match": response["headers"]["etag"]}}
+    assert (await handler(request))["status"] == 304
+
+
+def test_cache_evicts_least_recently_used_files():
+    fstat = os.stat(valid_source)
+    cache = StaticFileCache(max_bytes=10)
+    cache.put("/a", b"aaaa", {}, fstat)
+    cache.put("/b", b"bbbb", {}, fstat)
+    cache.get("/a")
+    cache.put("/c", b"cccc", {}, fstat)
+    assert cache.get("/b") is None
+    assert cache.get("/a") is not None
+    assert cache.cached_bytes == 8
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-4", 10) == [(0, 5)]
+    assert parse_range("bytes=5-", 10) == [(5, 5)]
+    assert parse_range("bytes=-3", 10) == [(7, 3)]
+    assert parse_range("bytes=8-100", 10) == [(8, 2)]
+    assert parse_range("bytes=0-0, 2-3", 10) == [(0, 1), (2, 2)]
+    assert parse_range("bytes=10-", 10) == []
+    for invalid in ["items=0-1", "bytes=", "bytes=a-1", "bytes=5-1", "bytes=-", "bytes=1"]:
+        assert parse_range(invalid, 10) is None, invalid
+
+
+async def consume(response):
+    if "stream" not in response:
+        return response["body"]
+    return b"".join([bytes(chunk) async for chunk in response["stream"]])
+
+
+@pytest.fixture(params=[0, 1024], ids=["streamed", "cached"])
+def range_handler(request, static_folder):
+    return apply_middleware(wrap_static(str(static_folder), cache_max_bytes=request.param))(noop_handler)
+
+
+@pytest.mark.asyncio
+async def test_single_ranges_are_responded_partially(range_handler):
+    for range_header, expected, content_range in [
+        ("bytes=0-6", b"console", "bytes 0-6/15"),
+        ("bytes=-2", b");", "bytes 13-14/15"),
+    ]:
+        response = await range_handler({"method": "GET", "path": "/app.js", "headers": {"range": range_header}})
+        assert response["status"] == 206
+        assert response["headers"]["content-range"] == content_range
+        assert response["headers"]["content-length"] == str(len(expected))
+        assert await consume(response) == expected
+
+
+@pytest.mark.asyncio
+async def test_multiple_ranges_are_responded_as_multipart(range_handler):
+    request = {"method": "GET", "path": "/app.js", "headers": {"range": "bytes=0-6, 8-10"}}
+    response = await range_handler(request)
+    assert response["status"] == 206
+    content_type = response["headers"]["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+
+    body = await consume(response)
+    assert len(body) == int(response["headers"]["content-length"])
+    parts = body.split(f"--{boundary}".encode())
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    assert parts[1].endswith(b"content-range: bytes 0-6/15\r\n\r\nconsole\r\n")
+    assert parts[2].endswith(b"content-range: bytes 8-10/15\r\n\r\nlog\r\n")
+
+
+@pytest.mark.asyncio
+async def test_unsatisfiable_ranges_are_responded_with_416(range_handler):
+    response = await range_handler({"method": "GET", "path": "/app.js", "headers": {"range": "bytes=100-"}})
+    assert response["status"] == 416
+    assert response["headers"]["content-range"] == "bytes */15"
+
+
+@pytest.mark.asyncio
+async def test_if_range_serves_the_whole_file_when_it_changed(range_handler):
+    etag = (await range_handler({"method": "GET", "path": "/app.js"}))["headers"]["etag"]
+    for if_range, expected_status in [(etag, 206), ("outdated", 200)]:
+        request = {"method": "GET", "path": "/app.js", "headers": {"range": "bytes=0-6", "if-range": if_range}}
+        response = await range_handler(request)
+        assert response["status"] == expected_status
+        assert response["headers"]["accept-ranges"] == "bytes"
+
+
+def test_negotiate_encodings():
+    assert negotiate_encodings("gzip, deflate, br", ("br", "gzip")) == ["br", "gzip"]
+    assert negotiate_encodings("gzip;q=0.5, br;q=0", ("br", "gzip")) == ["gzip"]
+    assert negotiate_encodings("*", ("br", "gzip")) == ["br", "gzip"]
+    assert negotiate_encodings("*, gzip;q=0", ("br", "gzip")) == ["br"]
+    assert negotiate_encodings("identity", ("br", "gzip")) == []
+
+
+def test_precompress_static_writes_gzip_sidecars(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "style.css").write_bytes(b"body { color: red; }\n" * 100)
+    (tmp_path / "tiny.txt").write_bytes(b"tiny")
+    (tmp_path / "random.bin").write_bytes(os.urandom(4096))
+
+    assert precompress_static(str(tmp_path)) == [str(tmp_path / "sub" / "style.css.gz")]
+    assert gzip.decompress((tmp_path / "sub" / "style.css.gz").read_bytes()) == b"body { color: red; }\n" * 100
+    assert precompress_static(str(tmp_path)) == [], "up-to-date sidecars are kept"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cache_max_bytes", [0, 4096])
+async def test_precompressed_sidecars_are_served_to_accepting_clients(tmp_path, cache_max_bytes):
+    content = b"body { color: red; }\n" * 100
+    (tmp_path / "style.css").write_bytes(content)
+    precompress_static(str(tmp_path))
+    handler = apply_middleware(
+        wrap_static(str(tmp_path), precompressed=("br", "gzip"), cache_max_bytes=cache_max_bytes)
+    )(noop_handler)
+
+    for _ in range(2):
+        request = {"method": "GET", "path": "/style.css", "headers": {"accept-encoding": "gzip, deflate, br"}}
+        compressed = await handler(request)
+        assert compressed["headers"]["content-encoding"] == "gzip"
+        assert compressed["headers"]["content-type"] == "text/css"
+        assert compressed["headers"]["vary"] == "accept-encoding"
+        assert gzip.decompress(await consume(compressed)) == content
+
+        identity = await handler({"method": "GET", "path": "/style.css", "headers": {}})
+        assert "content-encoding" not in identity["headers"]
+        assert identity["headers"]["vary"] == "accept-encoding"
+        assert await consume(identity) == content
+
+
+def test_unknown_precompressed_encodings_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        wrap_static(str(tmp_path), precompressed=("deflate",))
+
+
+@pytest.mark.asyncio
+async def test_indexed_static_files_are_served_without_probing_the_file_system(static_folder, monkeypatch):
+    (static_folder / "sub").mkdir()
+    (static_folder / "sub" / "deep.txt").write_bytes(b"deep")
+    middleware = wrap_static(str(static_folder), index=True)
+    handler = apply_middleware(middleware)(noop_handler)
+    assert len(middleware.static_index) == 3
+
+    def no_file_system(*args):
+        raise AssertionError("the file-system should not be probed")
+
+    monkeypatch.setattr(os.path, "isfile", no_file_system)
+    monkeypatch.setattr("shallot.middlewares.staticfiles.astat", no_file_system)
+    assert await handler({"method": "GET", "path": "/api/users"}) is unhandled
+    response = await handler({"method": "GET", "path": "/sub/deep.txt"})
+    assert response["status"] == 200
+    assert response["headers"]["content-length"] == "4"
+    assert await consume(response) == b"deep"
+
+
+@pytest.mark.asyncio
+async def test_static_index_can_be_invalidated(static_folder):
+    middleware = wrap_static(str(static_folder), index=True)
+    handler = apply_middleware(middleware)(noop_handler)
+    (static_folder / "new.txt").write_bytes(b"new")
+    assert await handler({"method": "GET", "path": "/new.txt"}) is unhandled
+
+    middleware.static_index.invalidate()
+    assert await consume(await handler({"method": "GET", "path": "/new.txt"})) == b"new"
+
+
+@pytest.mark.asyncio
+async def test_indexed_files_changed_after_the_scan_are_served_with_matching_headers(static_folder):
+    (static_folder / "grow.txt").write_bytes(b"small")
+    middleware = wrap_static(str(static_folder), index=True, cache_revalidate_s=0)
+    handler = apply_middleware(middleware)(noop_handler)
+    before = await handler({"method": "GET", "path": "/grow.txt"})
+    assert await consume(before) == b"small"
+
+    (static_folder / "grow.txt").write_bytes(b"grown after the scan")
+    response = await handler({"method": "GET", "path": "/grow.txt"})
+    content = await consume(response)
+    assert content == b"grown after the scan"
+    assert response["headers"]["content-length"] == str(len(content))
+    assert response["headers"]["etag"] != before["headers"]["etag"]
+
+    (static_folder / "grow.txt").unlink()
+    assert await handler({"method": "GET", "path": "/grow.txt"}) is unhandled
+
+
+@pytest.mark.asyncio
+async def test_static_index_is_rescanned_in_the_background(static_folder):
+    middleware = wrap_static(str(static_folder), index=True, index_rescan_s=0)
+    handler = apply_middleware(middleware)(noop_handler)
+    (static_folder / "new.txt").write_bytes(b"new")
+    assert await handler({"method": "GET", "path": "/new.txt"}) is unhandled, "the rescan is not awaited"
+
+    await middleware.static_index._rescan
+    assert await consume(await handler({"method": "GET", "path": "/new.txt"})) == b"new"
+    if middleware.static_index._rescan is not None:
+        await middleware.static_index._rescan
+
+
+@pytest.mark.asyncio
+async def test_mounted_static_files_skip_other_paths(static_folder, monkeypatch):
+    handler = apply_middleware(wrap_static(str(static_folder), mount="/assets"))(noop_handler)
+    assert await consume(await handler({"method": "GET", "path": "/assets/app.js"})) == b"console.log(1);"
+    assert await handler({"method": "GET", "path": "/assets/missing.js"}) is unhandled
+
+    def no_file_system(*args):
+        raise AssertionError("the file-system should not be probed")
+
+    monkeypatch.setattr(os.path, "isfile", no_file_system)
+    for path in ["/app.js", "/api/assets/app.js", "/assets"]:
+        assert await handler({"method": "GET", "path": path}) is unhandled
+
+
+@pytest.mark.asyncio
+async def test_multiple_mounts_dispatch_on_the_longest_prefix(tmp_path):
+    for folder, content in [("public", b"public"), ("assets", b"assets"), ("images", b"images")]:
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "file.txt").write_bytes(content)
+    mounts = {"/": "public", "/assets/": "assets", "/assets/images": "images"}
+    middleware = wrap_static_mounts(mounts, root_path=str(tmp_path), index=True)
+    handler = apply_middleware(middleware)(noop_handler)
+
+    for path, expected in [
+        ("/file.txt", b"public"),
+        ("/assets/file.txt", b"assets"),
+        ("/assets/images/file.txt", b"images"),
+    ]:
+        assert await consume(await handler({"method": "GET", "path": path})) == expected
+    assert await handler({"method": "GET", "path": "/assets/images/missing.txt"}) is unhandled
+    assert await handler({"method": "POST", "path": "/file.txt"}) is unhandled
+    assert set(middleware.static_indexes) == {"/", "/assets/", "/assets/images/"}
+
+
+def test_fingerprint_name():
+    assert fingerprint_name("app.js", "3f9a1c02") == "app.3f9a1c02.js"
+    assert fingerprint_name("css/app.min.css", "3f9a1c02") == "css/app.min.3f9a1c02.css"
+    assert fingerprint_name("LICENSE", "3f9a1c02") == "LICENSE.3f9a1c02"
+    assert fingerprint_name(".htaccess", "3f9a1c02") == ".htaccess.3f9a1c02"
+
+
+@pytest.mark.asyncio
+async def test_fingerprinted_assets_are_cached_immutable(static_folder):
+    manifest = AssetManifest(str(static_folder), mount="/assets/")
+    content_hash = hashlib.sha256(b"console.log(1);").hexdigest()
+    url = manifest.url("app.js")
+    assert url == f"/assets/app.{content_hash[:8]}.js"
+    assert manifest.url("/app.js") == url
+
+    handler = apply_middleware(wrap_assets(manifest))(noop_handler)
+    response = await handler({"method": "GET", "path": url})
+    assert response["status"] == 200
+    assert response["headers"]["cache-control"] == "public, max-age=31536000, immutable"
+    assert response["headers"]["etag"] == content_hash
+    assert await consume(response) == b"console.log(1);"
+
+    revalidated = await handler({"method": "GET", "path": url, "headers": {"if-none-match": content_hash}})
+    assert revalidated["status"] == 304
+    assert await handler({"method": "GET", "path": "/assets/app.js"}) is unhandled
+
+
+def test_fingerprints_only_change_with_the_content(static_folder):
+    before = AssetManifest(str(static_folder)).url("app.js")
+    os.utime(static_folder / "app.js", (1, 1))
+    assert AssetManifest(str(static_folder)).url("app.js") == before
+
+    (static_folder / "app.js").write_bytes(b"console.log(2);")
+    manifest = AssetManifest(str(static_folder))
+    assert manifest.url("app.js") != before
+    with pytest.raises(KeyError):
+        manifest.url("missing.js")
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+import pytest
+from functools import partial
+from shallot.threadpool import ensure_async, is_async_callable, SyncHandlerPool
+from shallot.middlewares import apply_middleware, wrap_routes
+
+
+def blocking_handler(request):
+    time.sleep(0.05)
+    return {"status": 200, "thread": threading.current_thread().name}
+
+
+async def async_handler(request):
+    return {"status": 200}
+
+
+def test_async_callables_are_detected():
+    class AsyncCallable:
+        async def __call__(self, request):
+            pass
+
+    assert is_async_callable(async_handler)
+    assert is_async_callable(partial(async_handler))
+    assert is_async_callable(AsyncCallable())
+    assert not is_async_callable(blocking_handler)
+    assert not is_async_callable(lambda request: request)
+
+
+def test_async_handlers_are_not_wrapped():
+    assert ensure_async(async_handler) is async_handler
+
+
+@pytest.mark.asyncio
+async def test_sync_handlers_do_not_block_the_event_loop():
+    handler = apply_middleware()(blocking_handler)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    ticker = asyncio.ensure_future(tick())
+    response = await handler({})
+    ticker.cancel()
+    assert response["thread"].startswith("shallot-sync")
+    assert ticks > 3
+
+
+@pytest.mark.asyncio
+async def test_sync_route_handlers_run_on_the_pool():
+    def user(request, uid):
+        return {"status": 200, "uid": uid, "thread": threading.current_thread().name}
+
+    handler = apply_middleware(wrap_routes([("/users/{uid}", ["GET"], user)]))(async_handler)
+    response = await handler({"path": "/users/7", "method": "GET"})
+    assert response["uid"] == "7"
+    assert response["thread"].startswith("shallot-sync")
+
+
+@pytest.mark.asyncio
+async def test_pool_reports_queue_depth_and_wait_time():
+    pool = SyncHandlerPool(max_workers=1)
+    calls = [asyncio.ensure_future(pool.run(time.sleep, 0.02)) for _ in range(3)]
+    await asyncio.sleep(0.005)
+    assert pool.queued == 2
+    assert pool.running == 1
+    await asyncio.gather(*calls)
+    assert pool.queued == 0
+    assert pool.completed == 3
+    assert pool.max_wait_s >= 0.03
+    assert 0 < pool.avg_wait_s <= pool.max_wait_s
+    pool.shutdown()